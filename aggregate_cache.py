@@ -0,0 +1,243 @@
+"""
+analysis 与 visualize 共用的派生结果缓存
+以结果文件内容哈希 + 分析代码版本为键，缓存分组聚合、分位数草图、
+逐问题摘要与响应相似度签名；JSONL 结果文件只增长时，仅增量处理新追加的记录
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import pickle
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+from aggregates import IncrementalAggregates, RunningStats
+from features import featurize
+from records import iter_results
+from response_index import tokenize
+from sketch import SketchSet
+from storage import MAGIC as STORE_MAGIC
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache")
+
+# 参与计算派生结果的模块，源码变化即视为分析代码版本变化
+_VERSIONED_MODULES = (
+    "aggregate_cache.py", "aggregates.py", "features.py", "sketch.py", "records.py", "response_index.py",
+    "storage.py"
+)
+
+# bottom-k MinHash 签名长度
+SIGNATURE_SIZE = 32
+# 每个问题参与相似度估计的响应样本上限
+SIMILARITY_SAMPLE = 64
+
+
+def code_version() -> str:
+    digest = hashlib.sha256()
+    for name in _VERSIONED_MODULES:
+        with open(os.path.join(os.path.dirname(__file__), name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def signature(text: str) -> Tuple[int, ...]:
+    """响应文本词项集合的 bottom-k MinHash 签名"""
+    hashes = {
+        int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+        for token in tokenize(text)
+    }
+    return tuple(heapq.nsmallest(SIGNATURE_SIZE, hashes))
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """由两个 bottom-k 签名估计词项集合的 Jaccard 相似度"""
+    if not a or not b:
+        return 0.0
+    union_k = heapq.nsmallest(SIGNATURE_SIZE, set(a) | set(b))
+    sa, sb = set(a), set(b)
+    return sum(1 for h in union_k if h in sa and h in sb) / len(union_k)
+
+
+class QuestionSummary:
+    """
+    单个问题在各身份下的响应摘要
+
+    相似度只在 SIMILARITY_SAMPLE 条响应的样本上估计：按 (身份, run_id) 的哈希
+    保留最小的若干条 (bottom-k 抽样)，样本与加入顺序无关，增量更新时结果不变；
+    估计值在样本变化前只计算一次，随派生结果一起缓存
+    """
+
+    __slots__ = ("question", "category", "lengths", "signatures", "_similarity")
+
+    def __init__(self, question: str, category: str):
+        self.question = question
+        self.category = category
+        self.lengths = RunningStats()
+        # 最大堆 (-优先级, 身份, run_id, 签名)，只保留优先级最小的 SIMILARITY_SAMPLE 条
+        self.signatures: List[Tuple[int, str, int, Tuple[int, ...]]] = []
+        self._similarity = None
+
+    def add(self, record: Dict):
+        response = record.get("response") or ""
+        self.lengths.add(len(response))
+
+        identity, run_id = record["identity_name"], record.get("run_id", 1)
+        priority = int.from_bytes(
+            hashlib.blake2b(f"{identity}|{run_id}".encode('utf-8'), digest_size=8).digest(), 'big'
+        )
+        if len(self.signatures) < SIMILARITY_SAMPLE:
+            heapq.heappush(self.signatures, (-priority, identity, run_id, signature(response)))
+        elif -priority > self.signatures[0][0]:
+            heapq.heapreplace(self.signatures, (-priority, identity, run_id, signature(response)))
+        else:
+            return
+        self._similarity = None
+
+    def mean_similarity(self) -> Optional[float]:
+        """不同身份响应之间的平均估计相似度"""
+        if self._similarity is None:
+            pairs = [
+                similarity(a[3], b[3])
+                for a, b in combinations(self.signatures, 2)
+                if a[1] != b[1]
+            ]
+            self._similarity = (sum(pairs) / len(pairs),) if pairs else (None,)
+        return self._similarity[0]
+
+
+class DerivedArtifacts:
+    """
+    从结果记录增量计算的全部派生结果
+    """
+
+    def __init__(self):
+        self.aggregates = IncrementalAggregates()
+        self.sketches = SketchSet()
+        self.questions: Dict[str, QuestionSummary] = {}
+        self.fingerprint: Optional[str] = None   # 已处理内容的 sha256 前缀
+
+    def add(self, record: Dict, features: Optional[Tuple[float, ...]] = None):
+        self.aggregates.add(record, features)
+        self.sketches.add(record)
+        if record.get("success"):
+            summary = self.questions.get(record["question_id"])
+            if summary is None:
+                summary = self.questions[record["question_id"]] = QuestionSummary(
+                    record["question"], record["category"]
+                )
+            summary.add(record)
+
+
+def _hash_prefix(full_path: str, size: int) -> str:
+    digest = hashlib.sha256()
+    remaining = size
+    with open(full_path, 'rb') as f:
+        while remaining > 0:
+            chunk = f.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _is_jsonl(full_path: str) -> bool:
+    with open(full_path, 'rb') as f:
+        head = f.read(64)
+    return not head.lstrip().startswith(b'[') and not head.startswith(STORE_MAGIC)
+
+
+def _complete_size(full_path: str, size: int) -> int:
+    """JSONL 文件中最后一个完整行结束处的字节偏移 (忽略正在写入的半行)"""
+    with open(full_path, 'rb') as f:
+        pos = size
+        while pos > 0:
+            start = max(0, pos - 4096)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            pos = start
+    return 0
+
+
+def _iter_lines(full_path: str, start: int, end: int):
+    """读取 JSONL 中 [start, end) 字节范围内的记录"""
+    with open(full_path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if start >= end:
+                break
+            start += len(line)
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_artifacts(file_path: str = "results.json", verbose: bool = True) -> Tuple[DerivedArtifacts, bool]:
+    """
+    读取 (必要时计算并保存) 结果文件的派生结果
+
+    Returns:
+        (派生结果, 是否直接命中缓存且无需任何更新)
+    """
+    full_path = os.path.join(os.path.dirname(__file__), file_path)
+    version = code_version()
+    cache_name = hashlib.sha256(os.path.abspath(full_path).encode('utf-8')).hexdigest()[:16]
+    cache_path = os.path.join(CACHE_DIR, f"{cache_name}.pkl")
+
+    jsonl = _is_jsonl(full_path)
+    size = os.path.getsize(full_path)
+    if jsonl:
+        size = _complete_size(full_path, size)
+    entry = None
+    if os.path.exists(cache_path):
+        # 损坏或格式不符的缓存文件 (例如写入时被中断) 按未命中处理
+        try:
+            with open(cache_path, 'rb') as f:
+                entry = pickle.load(f)
+            if entry["code_version"] != version or entry["size"] > size \
+                    or _hash_prefix(full_path, entry["size"]) != entry["prefix_hash"]:
+                entry = None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError,
+                KeyError, TypeError, ValueError):
+            entry = None
+
+    if entry is not None and entry["size"] == size:
+        if verbose:
+            print(f"⚡ 命中派生结果缓存 ({file_path})")
+        return entry["artifacts"], True
+
+    if entry is not None and jsonl:
+        artifacts = entry["artifacts"]
+        added = 0
+        for record, features in featurize(_iter_lines(full_path, entry["size"], size)):
+            artifacts.add(record, features)
+            added += 1
+        if verbose:
+            print(f"♻️  增量更新派生结果缓存: 新增 {added} 条记录")
+    else:
+        artifacts = DerivedArtifacts()
+        records = _iter_lines(full_path, 0, size) if jsonl else iter_results(full_path)
+        for record, features in featurize(records):
+            artifacts.add(record, features)
+        if verbose:
+            print(f"🧮 已计算派生结果并写入缓存 ({file_path})")
+
+    for summary in artifacts.questions.values():
+        summary.mean_similarity()   # 随缓存一起保存，命中缓存时不再两两比较
+
+    prefix_hash = _hash_prefix(full_path, size)
+    artifacts.fingerprint = prefix_hash[:16]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({
+            "code_version": version,
+            "size": size,
+            "prefix_hash": prefix_hash,
+            "artifacts": artifacts,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return artifacts, False
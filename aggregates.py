@@ -0,0 +1,153 @@
+"""
+可增量更新、可合并的分组聚合
+供 analysis、visualize、monitor 与聚合缓存共用，每条记录 O(1) 更新
+"""
+
+import math
+from collections import defaultdict, deque
+from typing import Dict, Iterable, Optional, Tuple
+
+from features import FEATURES, featurize
+
+
+class RunningStats:
+    """
+    Welford 在线均值 / 方差，可合并
+    """
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "RunningStats"):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        """样本方差，与 statistics.variance 一致"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        """总体标准差，与 np.std 一致"""
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+
+class GroupStats:
+    """
+    一个分组 (身份 / 类别 / 身份x类别) 的增量统计
+    """
+
+    __slots__ = ("total", "failed", "length", "tokens", "latency", "recent_latency", "features")
+
+    def __init__(self, recent: int = 20):
+        self.total = 0
+        self.failed = 0
+        self.length = RunningStats()
+        self.tokens = RunningStats()
+        self.latency = RunningStats()
+        self.recent_latency = deque(maxlen=recent)
+        self.features = {name: RunningStats() for name in FEATURES}
+
+    def add(self, record: Dict, features: Optional[Tuple[float, ...]] = None):
+        self.total += 1
+        if not record.get("success"):
+            self.failed += 1
+            return
+        latency = record.get("latency", 0)
+        self.length.add(len(record.get("response") or ""))
+        self.tokens.add(record.get("usage", {}).get("total_tokens", 0))
+        self.latency.add(latency)
+        self.recent_latency.append(latency)
+        if features is not None:
+            for name, value in zip(FEATURES, features):
+                self.features[name].add(value)
+
+    def column(self, name: str) -> RunningStats:
+        """按列名取统计量: length / tokens / latency 或 features.FEATURES 中的特征"""
+        if name in ("length", "tokens", "latency"):
+            return getattr(self, name)
+        return self.features[name]
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failed / self.total if self.total else 0.0
+
+    @property
+    def recent_latency_mean(self) -> float:
+        return sum(self.recent_latency) / len(self.recent_latency) if self.recent_latency else 0.0
+
+
+class IncrementalAggregates:
+    """
+    按身份、类别、身份x类别维护的增量聚合，每条记录 O(1) 更新
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.successful = 0
+        self.by_identity: Dict[str, GroupStats] = defaultdict(GroupStats)
+        self.by_category: Dict[str, GroupStats] = defaultdict(GroupStats)
+        self.by_identity_category: Dict[tuple, GroupStats] = defaultdict(GroupStats)
+
+    def add(self, record: Dict, features: Optional[Tuple[float, ...]] = None):
+        self.total += 1
+        if record.get("success"):
+            self.successful += 1
+        identity = record["identity_name"]
+        category = record["category"]
+        self.by_identity[identity].add(record, features)
+        self.by_category[category].add(record, features)
+        self.by_identity_category[(identity, category)].add(record, features)
+
+    def update(self, records: Iterable[Dict]) -> "IncrementalAggregates":
+        """逐条加入记录，响应特征经 features.featurize 计算 (带缓存)"""
+        for record, features in featurize(records):
+            self.add(record, features)
+        return self
+
+    def has_column(self, name: str) -> bool:
+        return any(s.column(name).count for s in self.by_identity.values())
+
+    def alerts(self, max_failure_rate: float = 0.2, latency_spike: float = 2.0) -> list:
+        """
+        找出失败率过高或近期延迟明显高于整体均值的身份
+        """
+        overall = RunningStats()
+        for stats in self.by_identity.values():
+            overall.merge(stats.latency)
+
+        alerts = []
+        for identity, stats in self.by_identity.items():
+            if stats.total >= 3 and stats.failure_rate > max_failure_rate:
+                alerts.append(f"{identity}: 失败率 {stats.failure_rate*100:.0f}% ({stats.failed}/{stats.total})")
+            if overall.count and len(stats.recent_latency) >= 3 \
+                    and stats.recent_latency_mean > latency_spike * overall.mean:
+                alerts.append(f"{identity}: 近期延迟 {stats.recent_latency_mean:.2f}s，"
+                              f"整体均值 {overall.mean:.2f}s")
+        return alerts
@@ -3,17 +3,22 @@
 定量分析 + 定性分析
 """
 
-import json
 import os
 from collections import defaultdict
 from typing import Dict, List
 import statistics
 
-def load_results(file_path: str = "results.json") -> List[Dict]:
-    """加载实验结果"""
+from records import ResultTable, load_table
+from aggregate_cache import QuestionSummary, load_artifacts
+from aggregates import IncrementalAggregates
+from features import FEATURE_LABELS
+from response_index import ResponseIndex
+from sketch import SketchSet, report_sketches
+
+def load_results(file_path: str = "results.json") -> ResultTable:
+    """加载实验结果为紧凑的 ResultTable，记录仍可按 dict 方式访问"""
     full_path = os.path.join(os.path.dirname(__file__), file_path)
-    with open(full_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return load_table(full_path)
 
 def quantitative_analysis(results: List[Dict]) -> Dict:
     """
@@ -65,48 +70,90 @@ def quantitative_analysis(results: List[Dict]) -> Dict:
     
     return analysis
 
-def print_quantitative_report(analysis: Dict):
-    """
-    打印定量分析报告
-    """
+def _print_group_table(title: str, label: str, width: int, rows):
+    """打印 (分组, 平均响应长度, 平均延迟, 平均Token数) 表格"""
+    print(f"\n{title}:")
+    print("-" * 70)
+    print(f"{label:<{width}} {'平均响应长度':<15} {'平均延迟(s)':<15} {'平均Token数':<15}")
+    print("-" * 70)
+    
+    for group, avg_length, avg_latency, avg_tokens in rows:
+        print(f"{group:<{width}} {avg_length:<15.0f} {avg_latency:<15.2f} {avg_tokens:<15.0f}")
+
+def _print_summary(total: int, successful: int):
     print("\n" + "=" * 70)
     print("📊 定量分析报告")
     print("=" * 70)
     
-    # 总体统计
-    summary = analysis["summary"]
     print(f"\n📈 总体统计:")
-    print(f"  总实验数: {summary['total_experiments']}")
-    print(f"  成功: {summary['successful']} ({summary['success_rate']*100:.1f}%)")
-    print(f"  失败: {summary['failed']}")
+    print(f"  总实验数: {total}")
+    print(f"  成功: {successful} ({(successful / total if total else 0)*100:.1f}%)")
+    print(f"  失败: {total - successful}")
+
+def print_quantitative_report(analysis: Dict, sketches: SketchSet = None):
+    """
+    打印定量分析报告
+    传入 sketches 时额外打印按身份 / 类别的延迟与 token 分位数
+    """
+    summary = analysis["summary"]
+    _print_summary(summary["total_experiments"], summary["successful"])
     
-    # 按身份统计
-    print(f"\n👤 按身份统计:")
-    print("-" * 70)
-    print(f"{'身份':<12} {'平均响应长度':<15} {'平均延迟(s)':<15} {'平均Token数':<15}")
-    print("-" * 70)
+    def rows(groups):
+        for group, data in groups.items():
+            avg_length = statistics.mean([len(r) for r in data["responses"]]) if data["responses"] else 0
+            avg_latency = statistics.mean(data["latencies"]) if data["latencies"] else 0
+            avg_tokens = statistics.mean(data["tokens"]) if data["tokens"] else 0
+            yield group, avg_length, avg_latency, avg_tokens
     
-    for identity, data in analysis["by_identity"].items():
-        avg_length = statistics.mean([len(r) for r in data["responses"]]) if data["responses"] else 0
-        avg_latency = statistics.mean(data["latencies"]) if data["latencies"] else 0
-        avg_tokens = statistics.mean(data["tokens"]) if data["tokens"] else 0
-        print(f"{identity:<12} {avg_length:<15.0f} {avg_latency:<15.2f} {avg_tokens:<15.0f}")
+    _print_group_table("👤 按身份统计", "身份", 12, rows(analysis["by_identity"]))
+    _print_group_table("📁 按问题类别统计", "类别", 15, rows(analysis["by_category"]))
     
-    # 按问题类别统计
-    print(f"\n📁 按问题类别统计:")
-    print("-" * 70)
-    print(f"{'类别':<15} {'平均响应长度':<15} {'平均延迟(s)':<15} {'平均Token数':<15}")
-    print("-" * 70)
+    if sketches is not None:
+        print_percentile_report(sketches)
+
+def print_aggregate_report(aggregates: IncrementalAggregates, sketches: SketchSet = None):
+    """
+    由增量聚合 (通常来自派生结果缓存) 打印与 print_quantitative_report 相同的报告
+    """
+    _print_summary(aggregates.total, aggregates.successful)
+    
+    def rows(groups):
+        for group, stats in groups.items():
+            if stats.length.count:
+                yield group, stats.length.mean, stats.latency.mean, stats.tokens.mean
+    
+    _print_group_table("👤 按身份统计", "身份", 12, rows(aggregates.by_identity))
+    _print_group_table("📁 按问题类别统计", "类别", 15, rows(aggregates.by_category))
     
-    for category, data in analysis["by_category"].items():
-        avg_length = statistics.mean([len(r) for r in data["responses"]]) if data["responses"] else 0
-        avg_latency = statistics.mean(data["latencies"]) if data["latencies"] else 0
-        avg_tokens = statistics.mean(data["tokens"]) if data["tokens"] else 0
-        print(f"{category:<15} {avg_length:<15.0f} {avg_latency:<15.2f} {avg_tokens:<15.0f}")
+    if sketches is not None:
+        print_percentile_report(sketches)
 
-def qualitative_analysis(results: List[Dict], output_file: str = "qualitative_report.md"):
+def print_percentile_report(sketches: SketchSet):
+    """
+    打印基于分位数草图的 p50/p90/p99
+    """
+    for dimension, title in (("identity", "👤 按身份"), ("category", "📁 按问题类别")):
+        print(f"\n{title}的分位数:")
+        print("-" * 70)
+        print(f"{'分组':<15} {'延迟 p50/p90/p99 (s)':<26} {'Token p50/p90/p99':<22}")
+        print("-" * 70)
+        token_sketches = sketches.groups("tokens", dimension)
+        for group, latency in sketches.groups("latency", dimension).items():
+            lat = "/".join(f"{v:.2f}" for v in latency.quantiles((0.5, 0.9, 0.99)))
+            tokens = token_sketches.get(group)
+            tok = "/".join(f"{v:.0f}" for v in tokens.quantiles((0.5, 0.9, 0.99))) if tokens else "-"
+            print(f"{group:<15} {lat:<26} {tok:<22}")
+        
+        ttft_sketches = sketches.groups("ttft", dimension)
+        if ttft_sketches:
+            for group, ttft in ttft_sketches.items():
+                q = "/".join(f"{v:.2f}" for v in ttft.quantiles((0.5, 0.9, 0.99)))
+                print(f"{group:<15} TTFT p50/p90/p99: {q}")
+
+def qualitative_analysis(results: List[Dict], output_file: str = "qualitative_report.md", source: str = None):
     """
     定性分析 - 生成详细的对比报告
+    source 为结果文件的内容指纹，写入报告头部，用于判断报告是否需要重新生成
     """
     # 按问题ID分组
     by_question = defaultdict(list)
@@ -117,8 +164,10 @@ def qualitative_analysis(results: List[Dict], output_file: str = "qualitative_re
     report_lines = [
         "# Identity Prompt Engineering 定性分析报告\n",
         f"生成时间: {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n",
-        "---\n\n"
     ]
+    if source:
+        report_lines.append(f"数据来源: {source}\n\n")
+    report_lines.append("---\n\n")
     
     for question_id, responses in by_question.items():
         if not responses:
@@ -152,14 +201,18 @@ def qualitative_analysis(results: List[Dict], output_file: str = "qualitative_re
     print(f"\n📝 定性分析报告已保存到: {output_file}")
     return output_path
 
-def compare_responses(results: List[Dict], question_id: str):
+def compare_responses(results: List[Dict], question_id: str, index: ResponseIndex = None):
     """
     对比特定问题在不同身份下的回答
+    传入 index 时直接从结果文件索引随机读取该问题的记录，不再线性扫描 results
     """
     print(f"\n🔍 问题对比: {question_id}")
     print("=" * 70)
     
-    question_results = [r for r in results if r["question_id"] == question_id and r.get("success")]
+    if index is not None:
+        question_results = [r for r in index.question(question_id) if r.get("success")]
+    else:
+        question_results = [r for r in results if r["question_id"] == question_id and r.get("success")]
     
     if not question_results:
         print("未找到该问题的结果")
@@ -179,6 +232,22 @@ def compare_responses(results: List[Dict], question_id: str):
         else:
             print(response)
 
+def print_feature_report(aggregates: IncrementalAggregates):
+    """
+    打印按身份的响应特征均值
+    """
+    columns = ("cjk_ratio", "headings", "list_items", "bold_spans", "code_blocks", "hedges", "refusal", "disclaimer")
+    
+    print(f"\n🧩 按身份的响应特征 (均值):")
+    print("-" * 100)
+    print(f"{'身份':<12} " + " ".join(f"{FEATURE_LABELS[c]:<10}" for c in columns))
+    print("-" * 100)
+    
+    for identity, stats in aggregates.by_identity.items():
+        if not stats.features[columns[0]].count:
+            continue
+        print(f"{identity:<12} " + " ".join(f"{stats.features[c].mean:<10.2f}" for c in columns))
+
 def find_interesting_differences(results: List[Dict]) -> List[Dict]:
     """
     找出有趣的差异 - 同一问题下响应差异最大的情况
@@ -212,11 +281,34 @@ def find_interesting_differences(results: List[Dict]) -> List[Dict]:
     
     return differences
 
-def print_interesting_differences(results: List[Dict], top_n: int = 5):
+def find_differences_from_summaries(questions: Dict[str, QuestionSummary]) -> List[Dict]:
+    """
+    由缓存的逐问题摘要计算与 find_interesting_differences 相同的结果，
+    并附带不同身份响应之间的平均估计相似度
+    """
+    differences = [
+        {
+            "question_id": question_id,
+            "question": summary.question,
+            "category": summary.category,
+            "variance": summary.lengths.variance,
+            "min_length": int(summary.lengths.min),
+            "max_length": int(summary.lengths.max),
+            "num_responses": summary.lengths.count,
+            "similarity": summary.mean_similarity()
+        }
+        for question_id, summary in questions.items()
+        if summary.lengths.count >= 2
+    ]
+    differences.sort(key=lambda x: x["variance"], reverse=True)
+    return differences
+
+def print_interesting_differences(results: List[Dict], top_n: int = 5, differences: List[Dict] = None):
     """
     打印最有趣的差异
     """
-    differences = find_interesting_differences(results)
+    if differences is None:
+        differences = find_interesting_differences(results)
     
     print(f"\n🔥 响应差异最大的 Top {top_n} 问题:")
     print("=" * 70)
@@ -226,26 +318,50 @@ def print_interesting_differences(results: List[Dict], top_n: int = 5):
         print(f"   问题: {diff['question'][:60]}...")
         print(f"   响应长度范围: {diff['min_length']} - {diff['max_length']} 字符")
         print(f"   差异度: {diff['variance']:.0f}")
+        if diff.get("similarity") is not None:
+            print(f"   身份间平均相似度: {diff['similarity']:.2f}")
+
+def _report_source(output_file: str):
+    """读取已有定性报告头部记录的数据来源"""
+    output_path = os.path.join(os.path.dirname(__file__), output_file)
+    if not os.path.exists(output_path):
+        return None
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for _, line in zip(range(8), f):
+            if line.startswith("数据来源: "):
+                return line[len("数据来源: "):].strip()
+    return None
 
-def generate_full_report(results_file: str = "results.json"):
+def generate_full_report(
+    results_file: str = "results.json",
+    output_file: str = "qualitative_report.md",
+    sketch_files: List[str] = None
+):
     """
     生成完整分析报告
+    定量部分来自派生结果缓存；缓存命中且定性报告已存在时不再重新解析结果文件
+    分位数优先取自 sketch_files 或结果文件旁的草图文件 (见 sketch.report_sketches)
     """
-    results = load_results(results_file)
+    artifacts, cache_hit = load_artifacts(results_file)
+    sketches = report_sketches(results_file, artifacts.sketches, sketch_files)
     
     print("\n" + "🔬 " * 20)
     print("       Identity Prompt Engineering 实验分析")
     print("🔬 " * 20)
     
     # 定量分析
-    analysis = quantitative_analysis(results)
-    print_quantitative_report(analysis)
+    print_aggregate_report(artifacts.aggregates, sketches)
+    print_feature_report(artifacts.aggregates)
     
     # 有趣差异
-    print_interesting_differences(results)
+    print_interesting_differences(None, differences=find_differences_from_summaries(artifacts.questions))
     
     # 生成定性报告
-    qualitative_analysis(results)
+    source = f"{results_file} (sha256 {artifacts.fingerprint})"
+    if cache_hit and _report_source(output_file) == source:
+        print(f"\n📝 结果未变化，沿用已有的定性分析报告: {output_file}")
+    else:
+        qualitative_analysis(load_results(results_file), output_file, source)
     
     print("\n" + "=" * 70)
     print("✅ 分析完成！")
@@ -254,8 +370,15 @@ def generate_full_report(results_file: str = "results.json"):
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) > 1:
-        results_file = sys.argv[1]
+    # --sketches 之后的参数为用于分位数报告的草图文件，例如分片各自的 .sketch.json
+    args = sys.argv[1:]
+    sketch_files = None
+    if "--sketches" in args:
+        i = args.index("--sketches")
+        args, sketch_files = args[:i], args[i + 1:]
+    
+    if args:
+        results_file = args[0]
     else:
         # 默认尝试加载 demo 结果或完整结果
         if os.path.exists(os.path.join(os.path.dirname(__file__), "demo_results.json")):
@@ -263,5 +386,5 @@ if __name__ == "__main__":
         else:
             results_file = "results.json"
     
-    generate_full_report(results_file)
+    generate_full_report(results_file, sketch_files=sketch_files)
 
@@ -0,0 +1,274 @@
+"""
+Token 预算控制
+- 运行前：本地估算每个 system prompt + 问题的输入 token，结合历史结果中
+  各身份 / 类别的输出 token 与延迟统计，预估整次实验的 token、花费与耗时
+- 运行中：跟踪实际用量，接近预算时放慢调度，下一次调用可能超出预算时停止调度
+"""
+
+import math
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aggregates import RunningStats
+from config import IDENTITIES, TEST_QUESTIONS, EXPERIMENT_PARAMS, OPENAI_MODEL, MODEL_PRICING
+from records import iter_results
+
+try:
+    import tiktoken
+except ImportError:  # 未安装时退回启发式估算
+    tiktoken = None
+
+# chat 格式每条消息与回复引导的额外 token
+MESSAGE_OVERHEAD = 7
+
+# 每次调用之间的固定间隔 (与 run_full_experiment 中的 sleep 一致)
+CALL_INTERVAL = 0.5
+
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]")
+_WORD_RE = re.compile(r"[A-Za-z]+|\d+")
+_PUNCT_RE = re.compile(r"[^\sA-Za-z0-9㐀-䶿一-鿿豈-﫿]")
+
+_encoding = None
+
+
+def count_tokens(text: str, model: str = OPENAI_MODEL) -> int:
+    """
+    本地估算文本的 token 数
+    安装了 tiktoken 时使用模型对应的编码，否则按 汉字 x0.8 + 单词 + 标点 估算
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text))
+    return math.ceil(
+        len(_CJK_RE.findall(text)) * 0.8 + len(_WORD_RE.findall(text)) + len(_PUNCT_RE.findall(text))
+    )
+
+
+def prompt_tokens(system_prompt: str, question: str, model: str = OPENAI_MODEL) -> int:
+    return count_tokens(system_prompt, model) + count_tokens(question, model) + MESSAGE_OVERHEAD
+
+
+def has_pricing(model: str = OPENAI_MODEL) -> bool:
+    return model in MODEL_PRICING
+
+
+def call_cost(input_tokens: float, output_tokens: float, model: str = OPENAI_MODEL) -> float:
+    """按 config.MODEL_PRICING 计算美元花费，未知模型返回 0 (执行花费预算前先用 has_pricing 检查)"""
+    pricing = MODEL_PRICING.get(model)
+    if pricing is None:
+        return 0.0
+    return (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1_000_000
+
+
+class CompletionHistory:
+    """
+    历史结果中的输出 token 与延迟统计
+    按 (身份, 类别) → 身份 → 类别 → 全局 的顺序回退查找
+    """
+
+    def __init__(self):
+        self.completion: Dict[Tuple, RunningStats] = {}
+        self.latency: Dict[Tuple, RunningStats] = {}
+
+    @classmethod
+    def from_results(cls, file_paths: List[str]) -> "CompletionHistory":
+        history = cls()
+        for file_path in file_paths:
+            full_path = os.path.join(os.path.dirname(__file__), file_path)
+            if not os.path.exists(full_path):
+                continue
+            for record in iter_results(full_path):
+                history.add(record)
+        return history
+
+    def add(self, record: Dict):
+        if not record.get("success"):
+            return
+        identity, category = record["identity_key"], record["category"]
+        completion = record.get("usage", {}).get("completion_tokens", 0)
+        latency = record.get("latency", 0)
+        for key in ((identity, category), (identity, None), (None, category), (None, None)):
+            self.completion.setdefault(key, RunningStats()).add(completion)
+            self.latency.setdefault(key, RunningStats()).add(latency)
+
+    def lookup(self, identity_key: str, category: str) -> Tuple[Optional[RunningStats], Optional[RunningStats]]:
+        for key in ((identity_key, category), (identity_key, None), (None, category), (None, None)):
+            if key in self.completion:
+                return self.completion[key], self.latency[key]
+        return None, None
+
+
+class RunEstimate:
+    """整次实验的预估"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_expected = 0.0
+        self.completion_p90 = 0.0
+        self.completion_max = 0
+        self.duration = 0.0
+        self.from_history = 0
+
+    @property
+    def tokens_expected(self) -> float:
+        return self.prompt_tokens + self.completion_expected
+
+    @property
+    def tokens_max(self) -> int:
+        return self.prompt_tokens + self.completion_max
+
+    def cost(self, completion_tokens: float, model: str = OPENAI_MODEL) -> float:
+        return call_cost(self.prompt_tokens, completion_tokens, model)
+
+
+def estimate_run(
+    identities: List[str] = None,
+    categories: List[str] = None,
+    num_runs: int = 1,
+    history: CompletionHistory = None,
+    max_tokens: int = None,
+    prompts: Iterable[Tuple[str, str]] = None
+) -> RunEstimate:
+    """
+    预估 run_full_experiment / run_variant_sweep 的 token、花费与耗时
+    prompts 为 (身份键, system prompt) 序列 (如身份变体)，None 时取 identities 在 IDENTITIES 中的 prompt；
+    没有历史数据的组合按 max_tokens 的一半估算输出长度、按 10 秒估算延迟
+    """
+    if identities is None:
+        identities = list(IDENTITIES.keys())
+    if prompts is None:
+        prompts = ((key, IDENTITIES[key]["system_prompt"]) for key in identities)
+    if categories is None:
+        categories = list(TEST_QUESTIONS.keys())
+    if max_tokens is None:
+        max_tokens = EXPERIMENT_PARAMS["max_tokens"]
+    history = history or CompletionHistory()
+
+    questions = [
+        (category, count_tokens(question_data["question"]) + MESSAGE_OVERHEAD)
+        for category in categories for question_data in TEST_QUESTIONS[category]
+    ]
+    estimate = RunEstimate()
+    for identity_key, system_prompt in prompts:
+        system_tokens = count_tokens(system_prompt)
+        for category, question_tokens in questions:
+            prompt = system_tokens + question_tokens
+            completion, latency = history.lookup(identity_key, category)
+            if completion is not None:
+                expected = completion.mean
+                p90 = min(max_tokens, completion.mean + 1.2816 * math.sqrt(completion.variance))
+                seconds = latency.mean
+                estimate.from_history += num_runs
+            else:
+                expected = p90 = max_tokens / 2
+                seconds = 10.0
+
+            estimate.calls += num_runs
+            estimate.prompt_tokens += prompt * num_runs
+            estimate.completion_expected += min(expected, max_tokens) * num_runs
+            estimate.completion_p90 += p90 * num_runs
+            estimate.completion_max += max_tokens * num_runs
+            estimate.duration += (seconds + CALL_INTERVAL) * num_runs
+    return estimate
+
+
+def print_estimate(estimate: RunEstimate, model: str = OPENAI_MODEL):
+    """
+    打印运行前预估
+    """
+    print(f"\n💰 运行前预估 (模型: {model})")
+    print("-" * 60)
+    print(f"  调用次数: {estimate.calls} (其中 {estimate.from_history} 次有历史数据)")
+    print(f"  输入 Token: {estimate.prompt_tokens:,}")
+    print(f"  总 Token: 预期 {estimate.tokens_expected:,.0f} / p90 "
+          f"{estimate.prompt_tokens + estimate.completion_p90:,.0f} / 上限 {estimate.tokens_max:,}")
+    if has_pricing(model):
+        print(f"  花费: 预期 ${estimate.cost(estimate.completion_expected, model):.2f} / p90 "
+              f"${estimate.cost(estimate.completion_p90, model):.2f} / 上限 "
+              f"${estimate.cost(estimate.completion_max, model):.2f}")
+    else:
+        print(f"  ⚠️ config.MODEL_PRICING 中没有 {model} 的价格，无法估算花费")
+    print(f"  预计耗时: {estimate.duration / 60:.1f} 分钟")
+    print("-" * 60)
+
+
+class BudgetGovernor:
+    """
+    运行中的预算控制
+
+    每次调度前以 已用量 + 本次最坏情况 (输入估算 + max_tokens) 判断：
+    - 超过预算: 停止调度
+    - 已用量超过预算的 throttle_at 比例: 每次调用前额外等待 throttle_delay 秒
+    """
+
+    def __init__(
+        self,
+        max_total_tokens: int = None,
+        max_cost: float = None,
+        model: str = OPENAI_MODEL,
+        max_tokens: int = None,
+        throttle_at: float = 0.8,
+        throttle_delay: float = 2.0
+    ):
+        if max_cost is not None and not has_pricing(model):
+            raise ValueError(f"设置了花费预算，但 config.MODEL_PRICING 中没有模型 {model} 的价格")
+        self.max_total_tokens = max_total_tokens
+        self.max_cost = max_cost
+        self.model = model
+        self.max_tokens = max_tokens if max_tokens is not None else EXPERIMENT_PARAMS["max_tokens"]
+        self.throttle_at = throttle_at
+        self.throttle_delay = throttle_delay
+        self.used_tokens = 0
+        self.used_cost = 0.0
+        self.stopped_reason: Optional[str] = None
+
+    def _fraction_used(self) -> float:
+        fractions = [0.0]
+        if self.max_total_tokens:
+            fractions.append(self.used_tokens / self.max_total_tokens)
+        if self.max_cost:
+            fractions.append(self.used_cost / self.max_cost)
+        return max(fractions)
+
+    def admit(self, system_prompt: str, question: str) -> Tuple[bool, float]:
+        """
+        判断是否可以调度下一次调用
+
+        Returns:
+            (是否允许, 调用前需要额外等待的秒数)
+        """
+        prompt = prompt_tokens(system_prompt, question, self.model)
+        worst_tokens = prompt + self.max_tokens
+        worst_cost = call_cost(prompt, self.max_tokens, self.model)
+
+        if self.max_total_tokens is not None and self.used_tokens + worst_tokens > self.max_total_tokens:
+            self.stopped_reason = (f"Token 预算即将超出: 已用 {self.used_tokens:,} + "
+                                   f"本次最多 {worst_tokens:,} > {self.max_total_tokens:,}")
+            return False, 0.0
+        if self.max_cost is not None and self.used_cost + worst_cost > self.max_cost:
+            self.stopped_reason = (f"花费预算即将超出: 已用 ${self.used_cost:.4f} + "
+                                   f"本次最多 ${worst_cost:.4f} > ${self.max_cost:.2f}")
+            return False, 0.0
+
+        return True, self.throttle_delay if self._fraction_used() >= self.throttle_at else 0.0
+
+    def record(self, result: Dict):
+        """记录一次调用的实际用量"""
+        usage = result.get("usage") or {}
+        self.used_tokens += usage.get("total_tokens", 0)
+        self.used_cost += call_cost(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), self.model)
+
+    def status(self) -> str:
+        parts = [f"{self.used_tokens:,} tokens", f"${self.used_cost:.4f}"]
+        if self.max_total_tokens:
+            parts[0] += f" / {self.max_total_tokens:,}"
+        if self.max_cost:
+            parts[1] += f" / ${self.max_cost:.2f}"
+        return ", ".join(parts)
@@ -6,6 +6,13 @@ Identity Prompt Engineering 实验
 # OpenAI 配置
 OPENAI_MODEL = "gpt-4o"  # 或使用 "gpt-4-turbo", "gpt-4o-mini" 等可用模型
 
+# 模型价格 (美元 / 百万 token)，用于预估与控制实验花费
+MODEL_PRICING = {
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
+}
+
 # 身份定义
 IDENTITIES = {
     "none": {
@@ -42,6 +49,43 @@ IDENTITIES = {
     }
 }
 
+# 身份变体文法 - 将 IDENTITIES 共用的模板拆成可独立扫描的因子
+# 每个因子为 {水平键: 填入模板的文本}，水平键用于生成稳定的变体 id 与名称
+PERSONA_GRAMMAR = {
+    "template": "You are {profession} with {years} years of experience. {style}{language}",
+    "factors": {
+        "profession": {
+            "doctor": "an experienced medical doctor",
+            "lawyer": "a senior lawyer",
+            "engineer": "a senior software engineer",
+            "teacher": "an experienced educator",
+            "scientist": "a research scientist",
+            "philosopher": "a philosopher",
+            "businessman": "a successful business executive"
+        },
+        "years": {
+            "2y": "2",
+            "5y": "5",
+            "10y": "10",
+            "20y": "20",
+            "40y": "40"
+        },
+        "style": {
+            "evidence": "You approach problems with evidence-based thinking.",
+            "logic": "You approach problems with logical reasoning and attention to detail.",
+            "systematic": "You approach problems systematically with technical precision.",
+            "decompose": "You approach problems by breaking them down into understandable components.",
+            "perspectives": "You approach problems by examining underlying assumptions and exploring multiple perspectives.",
+            "practical": "You approach problems with a focus on practical outcomes and value creation."
+        },
+        "language": {
+            "any": "",
+            "zh": " Always answer in Simplified Chinese.",
+            "en": " Always answer in English."
+        }
+    }
+}
+
 # 测试问题集 - 分为多个类别
 TEST_QUESTIONS = {
     # 医学相关问题
@@ -0,0 +1,274 @@
+"""
+两次运行结果之间的回归对比
+以 (identity_key, question_id, run_id) 对两个结果文件做哈希连接，
+逐单元计算 token、延迟、长度 (及可选的 quality 评分) 的变化并标注显著性
+"""
+
+import heapq
+import json
+import math
+import os
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from aggregates import RunningStats
+from records import iter_results
+
+METRICS = ("tokens", "latency", "length", "quality")
+
+# 单元 |z| 超过该值时视为显著 (约 95%)
+SIGNIFICANCE_Z = 1.96
+
+# 双侧 95% t 临界值，df = 1..30；更大的自由度取正态近似 SIGNIFICANCE_Z
+_T_CRITICAL = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+)
+
+
+def _t_critical(df: int) -> float:
+    return _T_CRITICAL[df - 1] if df <= len(_T_CRITICAL) else SIGNIFICANCE_Z
+
+
+def _metrics(record: Dict) -> Tuple[Optional[float], ...]:
+    if not record.get("success"):
+        return (None,) * len(METRICS)
+    quality = record.get("quality")
+    return (
+        record.get("usage", {}).get("total_tokens", 0),
+        record.get("latency", 0),
+        len(record.get("response") or ""),
+        float(quality) if quality is not None else None,
+    )
+
+
+def _key(record: Dict) -> Tuple[str, str, int]:
+    return record["identity_key"], record["question_id"], record.get("run_id", 1)
+
+
+class DeltaSummary:
+    """
+    某一分组内各指标的配对差值统计
+    """
+
+    def __init__(self):
+        self.cells = 0
+        self.deltas = {m: RunningStats() for m in METRICS}
+        self.base = {m: RunningStats() for m in METRICS}
+
+    def add(self, base: Tuple, new: Tuple):
+        self.cells += 1
+        for m, b, n in zip(METRICS, base, new):
+            if b is not None and n is not None:
+                self.deltas[m].add(n - b)
+                self.base[m].add(b)
+
+    def t_stat(self, metric: str) -> float:
+        stats = self.deltas[metric]
+        if stats.count < 2:
+            return 0.0
+        se = math.sqrt(stats.variance / stats.count)
+        if se == 0:
+            return 0.0 if stats.mean == 0 else math.copysign(math.inf, stats.mean)
+        return stats.mean / se
+
+    def to_dict(self) -> Dict:
+        out = {"cells": self.cells}
+        for m in METRICS:
+            stats = self.deltas[m]
+            if stats.count == 0:
+                continue
+            t = self.t_stat(m)
+            out[m] = {
+                "base_mean": self.base[m].mean,
+                "mean_delta": stats.mean,
+                "rel_delta": stats.mean / self.base[m].mean if self.base[m].mean else None,
+                "t": t if math.isfinite(t) else None,
+                "significant": stats.count > 1 and abs(t) > _t_critical(stats.count - 1),
+            }
+        return out
+
+
+def diff_results(
+    base_file: str,
+    new_file: str,
+    delta_file: str = "results_diff.jsonl",
+    top_n: int = 20
+) -> Dict:
+    """
+    对比两个结果文件
+
+    先读入 base 为 {键: 指标} 哈希表，同时累计每个 (身份, 问题) 跨 run_id 的离散度；
+    流式读取 new 两遍：第一遍累计全部配对差值的分布，第二遍逐单元连接并把差值写入
+    delta_file，只保留排名前 top_n 的变化
+
+    单元显著性 (噪声来源记录在单元的 "noise" 字段):
+    - "runs": 该 (身份, 问题) 在 base 中有多次运行时，
+      z = 差值 / (sqrt(2) * 跨 run_id 的样本标准差)
+    - "paired": 只有单次运行时，z = 差值 / 全部匹配单元配对差值的样本标准差
+    噪声标准差为 0 时，任何非零差值都视为显著 (z 记为 null)
+    分组显著性: 配对差值的 t 统计量
+    """
+    base_path = os.path.join(os.path.dirname(__file__), base_file)
+    new_path = os.path.join(os.path.dirname(__file__), new_file)
+    delta_path = os.path.join(os.path.dirname(__file__), delta_file)
+
+    base = {}
+    run_spread = defaultdict(lambda: [RunningStats() for _ in METRICS])   # (身份, 问题) 跨 run_id
+    for record in iter_results(base_path):
+        values = _metrics(record)
+        group = (record["identity_name"], record["category"])
+        key = _key(record)
+        base[key] = (group, record.get("success", False), values)
+        for stats, v in zip(run_spread[key[:2]], values):
+            if v is not None:
+                stats.add(v)
+
+    paired_spread = [RunningStats() for _ in METRICS]
+    for record in iter_results(new_path):
+        matched = base.get(_key(record))
+        if matched is None:
+            continue
+        for stats, b, n in zip(paired_spread, matched[2], _metrics(record)):
+            if b is not None and n is not None:
+                stats.add(n - b)
+
+    by_identity = defaultdict(DeltaSummary)
+    by_identity_category = defaultdict(DeltaSummary)
+    overall = DeltaSummary()
+    status_changes = defaultdict(int)
+    only_in_new = 0
+    top = []   # (score, seq, cell) 小顶堆
+
+    with open(delta_path, 'w', encoding='utf-8') as out:
+        for seq, record in enumerate(iter_results(new_path)):
+            key = _key(record)
+            matched = base.pop(key, None)
+            if matched is None:
+                only_in_new += 1
+                continue
+
+            group, base_success, base_values = matched
+            new_success = record.get("success", False)
+            if base_success != new_success:
+                status_changes["ok→fail" if base_success else "fail→ok"] += 1
+            new_values = _metrics(record)
+
+            cell = {
+                "level": "cell",
+                "identity_key": key[0],
+                "identity_name": group[0],
+                "category": group[1],
+                "question_id": key[1],
+                "run_id": key[2],
+                "success": [base_success, new_success],
+            }
+            score = 0.0
+            for i, (m, b, n) in enumerate(zip(METRICS, base_values, new_values)):
+                if b is None or n is None:
+                    continue
+                delta = n - b
+                runs = run_spread[key[:2]][i]
+                if runs.count > 1:
+                    noise, scale = "runs", math.sqrt(2 * runs.variance)
+                else:
+                    noise, scale = "paired", math.sqrt(paired_spread[i].variance)
+                z = delta / scale if scale else (0.0 if delta == 0 else math.inf)
+                cell[m] = {
+                    "base": b, "new": n, "delta": delta,
+                    "rel_delta": delta / b if b else None,
+                    "z": z if math.isfinite(z) else None,
+                    "noise": noise,
+                    "significant": abs(z) > SIGNIFICANCE_Z,
+                }
+                score = max(score, abs(z))
+            if base_success != new_success:
+                score = math.inf
+
+            out.write(json.dumps(cell, ensure_ascii=False) + "\n")
+
+            by_identity[group[0]].add(base_values, new_values)
+            by_identity_category[group].add(base_values, new_values)
+            overall.add(base_values, new_values)
+
+            entry = (score, seq, cell)
+            if top_n <= 0:
+                continue
+            if len(top) < top_n:
+                heapq.heappush(top, entry)
+            elif score > top[0][0]:
+                heapq.heapreplace(top, entry)
+
+        summary = {
+            "level": "summary",
+            "matched": overall.cells,
+            "only_in_base": len(base),
+            "only_in_new": only_in_new,
+            "status_changes": dict(status_changes),
+            "overall": overall.to_dict(),
+            "by_identity": {k: v.to_dict() for k, v in by_identity.items()},
+            "by_identity_category": {f"{k[0]}/{k[1]}": v.to_dict() for k, v in by_identity_category.items()},
+        }
+        out.write(json.dumps(summary, ensure_ascii=False) + "\n")
+
+    summary["top_changes"] = [cell for _, _, cell in sorted(top, key=lambda e: (-e[0], e[1]))]
+    return summary
+
+
+def print_diff_report(summary: Dict, delta_file: str = "results_diff.jsonl"):
+    """
+    打印回归对比报告
+    """
+    print("\n" + "=" * 78)
+    print("🔀 回归对比报告")
+    print("=" * 78)
+    print(f"  匹配单元: {summary['matched']}   仅在旧结果中: {summary['only_in_base']}   "
+          f"仅在新结果中: {summary['only_in_new']}")
+    for change, count in summary["status_changes"].items():
+        print(f"  成功状态变化 {change}: {count}")
+
+    def fmt(entry: Dict, metric: str, precision: int) -> str:
+        stats = entry.get(metric)
+        if not stats:
+            return f"{'-':>12}"
+        mark = "*" if stats["significant"] else " "
+        return f"{stats['mean_delta']:>+11.{precision}f}{mark}"
+
+    print(f"\n👤 按身份的平均变化 (* 表示显著):")
+    print("-" * 78)
+    print(f"{'身份':<14} {'单元':>6} {'ΔToken':>12} {'Δ延迟(s)':>12} {'Δ长度':>12} {'Δ质量':>12}")
+    print("-" * 78)
+    rows = list(summary["by_identity"].items()) + [("整体", summary["overall"])]
+    for identity, entry in rows:
+        print(f"{identity:<14} {entry['cells']:>6} {fmt(entry, 'tokens', 0)} {fmt(entry, 'latency', 2)} "
+              f"{fmt(entry, 'length', 0)} {fmt(entry, 'quality', 2)}")
+
+    print(f"\n🔥 变化最大的单元:")
+    print("-" * 78)
+    for i, cell in enumerate(summary["top_changes"], 1):
+        parts = []
+        for m in METRICS:
+            if m in cell:
+                mark = "*" if cell[m]["significant"] else ""
+                parts.append(f"{m} {cell[m]['base']:.0f}→{cell[m]['new']:.0f}{mark}" if m != "latency"
+                             else f"{m} {cell[m]['base']:.2f}→{cell[m]['new']:.2f}{mark}")
+        status = "" if cell["success"][0] == cell["success"][1] else f" [success {cell['success'][0]}→{cell['success'][1]}]"
+        print(f"{i:>3}. {cell['identity_name']} × {cell['question_id']} #{cell['run_id']}{status}: {', '.join(parts)}")
+
+    print(f"\n📄 逐单元差值已保存到: {delta_file}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="对比两次运行的结果文件")
+    parser.add_argument("base_file", help="旧结果文件 (JSON 数组或 JSONL)")
+    parser.add_argument("new_file", help="新结果文件 (JSON 数组或 JSONL)")
+    parser.add_argument("--output", type=str, default="results_diff.jsonl", help="逐单元差值输出文件")
+    parser.add_argument("--top", type=int, default=20, help="报告中列出的变化最大单元数")
+
+    args = parser.parse_args()
+
+    summary = diff_results(args.base_file, args.new_file, args.output, args.top)
+    print_diff_report(summary, args.output)
@@ -10,6 +10,10 @@ from datetime import datetime
 from typing import Dict, List, Optional
 from openai import OpenAI
 from config import IDENTITIES, TEST_QUESTIONS, EXPERIMENT_PARAMS, OPENAI_MODEL
+from variants import PersonaGrammar, iter_tasks
+from sketch import SketchSet, sketch_path
+from storage import prompt_hash, write_store
+from budget import BudgetGovernor, CompletionHistory, estimate_run, print_estimate
 
 # 初始化 OpenAI 客户端
 client = OpenAI()
@@ -18,13 +22,15 @@ def get_response(
     identity_key: str,
     question: str,
     temperature: float = 0.7,
-    max_tokens: int = 1000
+    max_tokens: int = 1000,
+    system_prompt: Optional[str] = None
 ) -> Dict:
     """
     使用指定身份获取 LLM 响应
+    system_prompt 不为空时直接使用它 (用于 variants 生成的身份变体)
     """
-    identity = IDENTITIES[identity_key]
-    system_prompt = identity["system_prompt"]
+    if system_prompt is None:
+        system_prompt = IDENTITIES[identity_key]["system_prompt"]
     
     start_time = time.time()
     
@@ -66,17 +72,21 @@ def run_single_experiment(
 ) -> Dict:
     """
     运行单次实验
+    记录中保存实际发送的 system prompt 的 sha256，归档时据此确认 prompt 原文
     """
+    system_prompt = IDENTITIES[identity_key]["system_prompt"]
     result = get_response(
         identity_key=identity_key,
         question=question_data["question"],
         temperature=EXPERIMENT_PARAMS["temperature"],
-        max_tokens=EXPERIMENT_PARAMS["max_tokens"]
+        max_tokens=EXPERIMENT_PARAMS["max_tokens"],
+        system_prompt=system_prompt
     )
     
     return {
         "identity_key": identity_key,
         "identity_name": IDENTITIES[identity_key]["name"],
+        "system_prompt_hash": prompt_hash(system_prompt),
         "question_id": question_data["id"],
         "question": question_data["question"],
         "category": question_data["category"],
@@ -90,7 +100,11 @@ def run_full_experiment(
     identities: List[str] = None,
     categories: List[str] = None,
     num_runs: int = 1,
-    output_file: str = "results.json"
+    output_file: str = "results.json",
+    budget_tokens: Optional[int] = None,
+    budget_cost: Optional[float] = None,
+    history_files: List[str] = None,
+    estimate_only: bool = False
 ) -> List[Dict]:
     """
     运行完整实验
@@ -99,7 +113,16 @@ def run_full_experiment(
         identities: 要测试的身份列表，None 表示全部
         categories: 要测试的问题类别，None 表示全部
         num_runs: 每个组合运行次数
-        output_file: 结果输出文件
+        output_file: 结果输出文件，以 .store 结尾时写成规范化的压缩归档 (见 storage.py)
+        budget_tokens: 总 Token 上限，None 表示不限
+        budget_cost: 总花费上限 (美元)，None 表示不限
+        history_files: 用于预估输出长度的历史结果文件，None 表示 output_file 本身
+        estimate_only: 只打印运行前预估，不调用 API
+    
+    运行过程中每条结果会立即追加到同名的 .jsonl 流文件中
+    (output_file 本身是 .jsonl 时为 <名称>.stream.jsonl)，
+    供 monitor.py 实时跟踪；设置预算后，接近预算时放慢调度，
+    下一次调用可能超出预算时提前结束并保存已完成的结果
     """
     if identities is None:
         identities = list(IDENTITIES.keys())
@@ -124,48 +147,216 @@ def run_full_experiment(
     print(f"总实验数: {total_combinations}")
     print(f"=" * 60)
     
-    current = 0
+    history = CompletionHistory.from_results(history_files or [output_file])
+    print_estimate(estimate_run(identities, categories, num_runs, history))
+    if estimate_only:
+        return results
     
-    for category in categories:
-        print(f"\n📁 类别: {category}")
+    governor = None
+    if budget_tokens is not None or budget_cost is not None:
+        governor = BudgetGovernor(max_total_tokens=budget_tokens, max_cost=budget_cost)
+    
+    output_path = os.path.join(os.path.dirname(__file__), output_file)
+    stream_path = os.path.splitext(output_path)[0] + ".jsonl"
+    if stream_path == output_path:
+        stream_path = os.path.splitext(output_path)[0] + ".stream.jsonl"
+    stream = open(stream_path, 'w', encoding='utf-8')
+    sketches = SketchSet()
+    
+    try:
+        current = 0
+        stopped = False
+    
+        for category in categories:
+            if stopped:
+                break
+            print(f"\n📁 类别: {category}")
         
-        for question_data in TEST_QUESTIONS[category]:
-            print(f"\n  ❓ 问题: {question_data['id']}")
+            for question_data in TEST_QUESTIONS[category]:
+                if stopped:
+                    break
+                print(f"\n  ❓ 问题: {question_data['id']}")
             
-            for identity_key in identities:
-                identity_name = IDENTITIES[identity_key]["name"]
+                for identity_key in identities:
+                    if stopped:
+                        break
+                    identity_name = IDENTITIES[identity_key]["name"]
                 
-                for run in range(1, num_runs + 1):
-                    current += 1
-                    print(f"    [{current}/{total_combinations}] 身份: {identity_name}, 运行 #{run}...", end=" ")
+                    for run in range(1, num_runs + 1):
+                        if governor is not None:
+                            allowed, delay = governor.admit(
+                                IDENTITIES[identity_key]["system_prompt"], question_data["question"]
+                            )
+                            if not allowed:
+                                print(f"\n🛑 停止调度: {governor.stopped_reason}")
+                                stopped = True
+                                break
+                            if delay:
+                                print(f"    ⏳ 已用 {governor.status()}，放慢调度 {delay:.1f}s")
+                                time.sleep(delay)
+                    
+                        current += 1
+                        print(f"    [{current}/{total_combinations}] 身份: {identity_name}, 运行 #{run}...", end=" ")
                     
-                    result = run_single_experiment(
-                        identity_key=identity_key,
-                        question_data=question_data,
-                        run_id=run
-                    )
-                    results.append(result)
+                        result = run_single_experiment(
+                            identity_key=identity_key,
+                            question_data=question_data,
+                            run_id=run
+                        )
+                        results.append(result)
+                        sketches.add(result)
+                        if governor is not None:
+                            governor.record(result)
+                        stream.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        stream.flush()
                     
-                    if result["success"]:
-                        print(f"✓ ({result['latency']:.2f}s, {result['usage']['total_tokens']} tokens)")
-                    else:
-                        print(f"✗ Error: {result.get('error', 'Unknown')}")
+                        if result["success"]:
+                            print(f"✓ ({result['latency']:.2f}s, {result['usage']['total_tokens']} tokens)")
+                        else:
+                            print(f"✗ Error: {result.get('error', 'Unknown')}")
                     
-                    # 避免 rate limiting
-                    time.sleep(0.5)
+                        # 避免 rate limiting
+                        time.sleep(0.5)
     
-    # 保存结果
-    output_path = os.path.join(os.path.dirname(__file__), output_file)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    finally:
+        # 中断或异常时同样保存已完成的结果与分位数草图
+        stream.close()
+        if output_path.endswith(".store"):
+            write_store(results, output_path)
+        elif output_path.endswith(".jsonl"):
+            with open(output_path, 'w', encoding='utf-8') as f:
+                for result in results:
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        else:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        sketches.save(sketch_path(output_path))
     
     print(f"\n{'=' * 60}")
     print(f"✅ 实验完成！结果已保存到: {output_file}")
     print(f"成功: {sum(1 for r in results if r['success'])}/{len(results)}")
+    if governor is not None:
+        print(f"预算使用: {governor.status()}")
     print(f"{'=' * 60}")
     
     return results
 
+def run_variant_sweep(
+    strategy: str = "factorial",
+    num_variants: int = None,
+    categories: List[str] = None,
+    num_runs: int = 1,
+    seed: int = 0,
+    output_file: str = "variant_results.jsonl",
+    budget_tokens: Optional[int] = None,
+    budget_cost: Optional[float] = None,
+    history_files: List[str] = None,
+    estimate_only: bool = False
+) -> int:
+    """
+    运行身份变体扫描
+    变体与任务均惰性生成，结果逐条写入 JSONL，内存占用与变体总数无关
+    
+    Args:
+        strategy: 变体采样策略 factorial / lhs / random
+        num_variants: lhs 与 random 的变体数
+        categories: 要测试的问题类别，None 表示全部
+        num_runs: 每个组合运行次数
+        seed: 采样随机种子
+        output_file: JSONL 结果文件
+        budget_tokens: 总 Token 上限，None 表示不限
+        budget_cost: 总花费上限 (美元)，None 表示不限
+        history_files: 用于预估输出长度的历史结果文件，None 表示 output_file 本身
+        estimate_only: 只打印运行前预估，不调用 API
+    
+    Returns:
+        完成的实验数
+    """
+    grammar = PersonaGrammar.from_config()
+    variants = grammar.sample(strategy, num_variants, seed)
+    
+    print(f"=" * 60)
+    print(f"Identity 变体扫描")
+    print(f"=" * 60)
+    print(f"模型: {OPENAI_MODEL}")
+    print(f"因子: {grammar.factor_names} (全组合 {len(grammar)} 个)")
+    print(f"采样策略: {strategy}" + (f" x {num_variants}" if num_variants else ""))
+    print(f"=" * 60)
+    
+    # 采样是确定性的，预估时重新采样一遍，不必把变体全部保存在内存中
+    history = CompletionHistory.from_results(history_files or [output_file])
+    sampled = ((v.variant_id, v.system_prompt) for v in grammar.sample(strategy, num_variants, seed))
+    print_estimate(estimate_run(categories=categories, num_runs=num_runs, history=history, prompts=sampled))
+    if estimate_only:
+        return 0
+    
+    governor = None
+    if budget_tokens is not None or budget_cost is not None:
+        governor = BudgetGovernor(max_total_tokens=budget_tokens, max_cost=budget_cost)
+    
+    output_path = os.path.join(os.path.dirname(__file__), output_file)
+    sketches = SketchSet()
+    current = 0
+    succeeded = 0
+    
+    with open(output_path, 'w', encoding='utf-8') as stream:
+        for variant, question_data, run in iter_tasks(variants, categories, num_runs):
+            if governor is not None:
+                allowed, delay = governor.admit(variant.system_prompt, question_data["question"])
+                if not allowed:
+                    print(f"\n🛑 停止调度: {governor.stopped_reason}")
+                    break
+                if delay:
+                    print(f"    ⏳ 已用 {governor.status()}，放慢调度 {delay:.1f}s")
+                    time.sleep(delay)
+            
+            current += 1
+            print(f"  [{current}] {variant.name} × {question_data['id']} #{run}...", end=" ")
+            
+            result = get_response(
+                identity_key=variant.variant_id,
+                question=question_data["question"],
+                temperature=EXPERIMENT_PARAMS["temperature"],
+                max_tokens=EXPERIMENT_PARAMS["max_tokens"],
+                system_prompt=variant.system_prompt
+            )
+            record = {
+                "identity_key": variant.variant_id,
+                "identity_name": variant.name,
+                "system_prompt_hash": prompt_hash(variant.system_prompt),
+                "variant": dict(variant.levels),
+                "question_id": question_data["id"],
+                "question": question_data["question"],
+                "category": question_data["category"],
+                "difficulty": question_data["difficulty"],
+                "run_id": run,
+                "timestamp": datetime.now().isoformat(),
+                **result
+            }
+            stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            stream.flush()
+            sketches.add(record)
+            if governor is not None:
+                governor.record(record)
+            
+            if result["success"]:
+                succeeded += 1
+                print(f"✓ ({result['latency']:.2f}s, {result['usage']['total_tokens']} tokens)")
+            else:
+                print(f"✗ Error: {result.get('error', 'Unknown')}")
+            
+            # 避免 rate limiting
+            time.sleep(0.5)
+    
+    sketches.save(sketch_path(output_path))
+    
+    print(f"\n{'=' * 60}")
+    print(f"✅ 扫描完成！结果已保存到: {output_file}")
+    print(f"成功: {succeeded}/{current}")
+    print(f"{'=' * 60}")
+    
+    return current
+
 def run_quick_demo():
     """
     快速演示：用少量身份和问题测试
@@ -206,22 +397,51 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Identity Prompt Engineering 实验")
-    parser.add_argument("--mode", choices=["demo", "full", "test"], default="demo",
-                       help="运行模式: demo(快速演示), full(完整实验), test(单独测试)")
+    parser.add_argument("--mode", choices=["demo", "full", "test", "sweep"], default="demo",
+                       help="运行模式: demo(快速演示), full(完整实验), test(单独测试), sweep(身份变体扫描)")
     parser.add_argument("--identity", type=str, help="测试特定身份 (test模式)")
     parser.add_argument("--question", type=str, help="测试特定问题 (test模式)")
     parser.add_argument("--runs", type=int, default=1, help="每组合运行次数")
+    parser.add_argument("--strategy", choices=["factorial", "lhs", "random"], default="lhs",
+                       help="变体采样策略 (sweep模式)")
+    parser.add_argument("--variants", type=int, default=50, help="lhs/random 采样的变体数 (sweep模式)")
+    parser.add_argument("--seed", type=int, default=0, help="变体采样随机种子 (sweep模式)")
+    parser.add_argument("--output", type=str, default="results.json",
+                       help="结果文件 (full模式)，.store 结尾时写成压缩归档")
+    parser.add_argument("--estimate", action="store_true", help="只打印运行前预估，不调用 API (full/sweep模式)")
+    parser.add_argument("--budget-tokens", type=int, default=None, help="总 Token 上限 (full/sweep模式)")
+    parser.add_argument("--budget-cost", type=float, default=None, help="总花费上限，单位美元 (full/sweep模式)")
+    parser.add_argument("--history", nargs="*", default=None,
+                       help="用于预估输出长度的历史结果文件 (full/sweep模式)")
     
     args = parser.parse_args()
     
     if args.mode == "demo":
         run_quick_demo()
     elif args.mode == "full":
-        run_full_experiment(num_runs=args.runs)
+        run_full_experiment(
+            num_runs=args.runs,
+            output_file=args.output,
+            budget_tokens=args.budget_tokens,
+            budget_cost=args.budget_cost,
+            history_files=args.history,
+            estimate_only=args.estimate
+        )
     elif args.mode == "test":
         if args.identity and args.question:
             run_specific_test(args.identity, args.question)
         else:
             print("test 模式需要 --identity 和 --question 参数")
             print(f"可用身份: {list(IDENTITIES.keys())}")
+    elif args.mode == "sweep":
+        run_variant_sweep(
+            strategy=args.strategy,
+            num_variants=args.variants,
+            num_runs=args.runs,
+            seed=args.seed,
+            budget_tokens=args.budget_tokens,
+            budget_cost=args.budget_cost,
+            history_files=args.history,
+            estimate_only=args.estimate
+        )
 
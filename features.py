@@ -0,0 +1,213 @@
+"""
+响应特征提取
+在字符长度之外，为每条响应计算中英文混合、Markdown 结构、
+模糊措辞、拒答与免责声明等特征；按响应哈希缓存，分块在进程池中并行计算
+"""
+
+import hashlib
+import os
+import pickle
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+CACHE_PATH = os.path.join(os.path.dirname(__file__), ".cache", "features.pkl")
+# 特征缓存条目上限，超出时保存前淘汰最久未用的条目
+CACHE_MAX_ENTRIES = 200_000
+
+# 特征列名与展示名；"length" / "tokens" / "latency" 为 GroupStats 内置列
+FEATURES = (
+    "cjk_chars", "latin_words", "cjk_ratio", "lines", "headings", "list_items",
+    "code_blocks", "bold_spans", "hedges", "refusal", "disclaimer",
+)
+
+FEATURE_LABELS = {
+    "length": "响应长度",
+    "tokens": "Token数",
+    "latency": "响应延迟",
+    "cjk_chars": "汉字数",
+    "latin_words": "英文单词数",
+    "cjk_ratio": "中文占比",
+    "lines": "行数",
+    "headings": "Markdown 标题数",
+    "list_items": "列表项数",
+    "code_blocks": "代码块数",
+    "bold_spans": "加粗片段数",
+    "hedges": "模糊措辞次数",
+    "refusal": "拒答率",
+    "disclaimer": "免责声明率",
+}
+
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]")
+_LATIN_WORD_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s", re.MULTILINE)
+_LIST_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+", re.MULTILINE)
+_CODE_FENCE_RE = re.compile(r"^\s*```", re.MULTILINE)
+_BOLD_RE = re.compile(r"\*\*[^*\n]+\*\*")
+_HEDGE_RE = re.compile(
+    r"可能|也许|或许|大概|似乎|通常|一般来说|不一定|取决于|"
+    r"\b(?:may|might|perhaps|possibly|likely|typically|generally|depends)\b",
+    re.IGNORECASE,
+)
+_REFUSAL_RE = re.compile(
+    r"我无法|我不能|无法提供|不能提供|抱歉|"
+    r"\bI (?:can(?:'|no)t|am unable to|won't)\b|\bI'm (?:sorry|unable)\b",
+    re.IGNORECASE,
+)
+_DISCLAIMER_RE = re.compile(
+    r"咨询(?:医生|专业|律师)|寻求专业|仅供参考|不构成|不能替代|"
+    r"\bconsult (?:a|your) (?:doctor|physician|lawyer|attorney|professional)\b|"
+    r"\bnot (?:medical|legal|financial) advice\b",
+    re.IGNORECASE,
+)
+
+
+def extract_features(text: str) -> Tuple[float, ...]:
+    """按 FEATURES 的顺序返回一条响应的特征向量"""
+    text = text or ""
+    cjk = len(_CJK_RE.findall(text))
+    words = _LATIN_WORD_RE.findall(text)
+    latin_letters = sum(len(w) for w in words)
+    return (
+        cjk,
+        len(words),
+        cjk / (cjk + latin_letters) if cjk + latin_letters else 0.0,
+        text.count("\n") + 1 if text else 0,
+        len(_HEADING_RE.findall(text)),
+        len(_LIST_RE.findall(text)),
+        len(_CODE_FENCE_RE.findall(text)) // 2,
+        len(_BOLD_RE.findall(text)),
+        len(_HEDGE_RE.findall(text)),
+        1 if _REFUSAL_RE.search(text) else 0,
+        1 if _DISCLAIMER_RE.search(text) else 0,
+    )
+
+
+def _extract_chunk(texts: List[str]) -> List[Tuple[float, ...]]:
+    return [extract_features(t) for t in texts]
+
+
+def response_hash(text: str) -> bytes:
+    return hashlib.blake2b((text or "").encode('utf-8'), digest_size=16).digest()
+
+
+class FeatureCache:
+    """
+    以响应哈希为键的特征缓存，持久化在 .cache/features.pkl
+    条目按最近使用排序，保存时只保留最近使用的 max_entries 条
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: Dict[bytes, Tuple[float, ...]] = {}
+        self.dirty = False
+        if os.path.exists(path):
+            # 缓存文件损坏时 (例如写入时被中断) 从空缓存开始
+            try:
+                with open(path, 'rb') as f:
+                    state = pickle.load(f)
+                if state.get("features") == FEATURES:
+                    self.entries = dict(state["entries"])
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError,
+                    KeyError, TypeError, ValueError):
+                self.entries = {}
+
+    def get(self, key: bytes) -> Optional[Tuple[float, ...]]:
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.entries[key] = value   # 移到末尾，下次保存时按最近使用顺序写出
+        return value
+
+    def put(self, key: bytes, value: Tuple[float, ...]):
+        self.entries[key] = value
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        if len(self.entries) > self.max_entries:
+            self.entries = dict(islice(self.entries.items(), len(self.entries) - self.max_entries, None))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"features": FEATURES, "entries": self.entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def featurize(
+    records: Iterable[Dict],
+    workers: int = None,
+    chunk_size: int = 2000,
+    cache: FeatureCache = None
+) -> Iterator[Tuple[Dict, Optional[Tuple[float, ...]]]]:
+    """
+    按输入顺序产出 (记录, 特征向量)，失败记录的特征为 None
+
+    记录流按 chunk_size 分块；每块中缓存未命中的响应提交到进程池，
+    同时在途的块数受限，内存占用与输入总量无关
+
+    Args:
+        records: 结果记录流
+        workers: 进程数，None 表示全部 CPU 核心，1 表示在当前进程内计算
+        chunk_size: 每块记录数
+        cache: 特征缓存，None 时使用默认的持久化缓存并在结束时保存
+    """
+    own_cache = cache is None
+    if own_cache:
+        cache = FeatureCache()
+    workers = workers or os.cpu_count() or 1
+    executor = None
+
+    def submit(chunk):
+        nonlocal executor
+        keys = []
+        missing = {}
+        for record in chunk:
+            if not record.get("success"):
+                keys.append(None)
+                continue
+            key = response_hash(record.get("response"))
+            keys.append(key)
+            if cache.get(key) is None and key not in missing:
+                missing[key] = record.get("response")
+        texts = list(missing.values())
+        if workers > 1 and texts:
+            # 进程池在第一次出现缓存未命中时才创建，全部命中时不付启动开销
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=workers)
+            future = executor.submit(_extract_chunk, texts)
+        else:
+            future = _extract_chunk(texts)
+        return chunk, keys, list(missing.keys()), future
+
+    def collect(pending):
+        chunk, keys, missing_keys, future = pending
+        values = future.result() if hasattr(future, "result") else future
+        for key, value in zip(missing_keys, values):
+            cache.put(key, value)
+        for record, key in zip(chunk, keys):
+            yield record, (cache.get(key) if key is not None else None)
+
+    in_flight = deque()
+    chunk = []
+    try:
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                in_flight.append(submit(chunk))
+                chunk = []
+                if len(in_flight) > workers * 2:
+                    yield from collect(in_flight.popleft())
+        if chunk:
+            in_flight.append(submit(chunk))
+        while in_flight:
+            yield from collect(in_flight.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if own_cache:
+            cache.save()
@@ -0,0 +1,174 @@
+"""
+实验运行中的实时增量分析
+跟踪 run_full_experiment 写出的 .jsonl 结果流，增量更新按身份 / 类别的聚合，
+以限定频率刷新终端面板与图表，尽早发现某个身份失败或延迟突增
+"""
+
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional
+
+from aggregates import IncrementalAggregates
+from features import extract_features
+from sketch import SketchSet
+
+
+# 结果流被截断 (例如以同一输出文件重新开始实验) 时由 tail_records 产出，调用方应清空累计状态
+RESTARTED = object()
+
+
+def tail_records(
+    full_path: str,
+    poll_interval: float = 0.5,
+    idle_timeout: Optional[float] = None
+) -> Iterator[Optional[Dict]]:
+    """
+    跟踪 JSONL 结果流，逐条产出新写入的记录
+    没有新数据时产出 None，便于调用方按时间刷新；
+    文件被截断时从头重新读取并产出 RESTARTED；
+    无法解析的行 (如截断后读到的半行) 跳过；
+    idle_timeout 秒内没有新数据时结束 (None 表示一直跟踪)
+    """
+    while not os.path.exists(full_path):
+        yield None
+        time.sleep(poll_interval)
+
+    last_data = time.time()
+    buffer = b""
+    with open(full_path, 'rb') as f:
+        while True:
+            if os.fstat(f.fileno()).st_size < f.tell():
+                f.seek(0)
+                buffer = b""
+                yield RESTARTED
+
+            chunk = f.read()
+            if chunk:
+                last_data = time.time()
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    yield record
+                continue
+
+            if idle_timeout is not None and time.time() - last_data > idle_timeout:
+                return
+            yield None
+            time.sleep(poll_interval)
+
+
+def render_dashboard(aggregates: IncrementalAggregates, source: str) -> str:
+    """
+    终端面板文本
+    """
+    lines = [
+        "=" * 78,
+        f"📡 实时监控: {source}    {time.strftime('%H:%M:%S')}",
+        "=" * 78,
+        f"已完成: {aggregates.total}   成功: {aggregates.successful}   "
+        f"失败: {aggregates.total - aggregates.successful}",
+        "",
+        f"{'身份':<12} {'完成':>6} {'失败率':>8} {'平均长度':>10} {'平均Token':>10} "
+        f"{'平均延迟':>9} {'近期延迟':>9} {'最大延迟':>9}",
+        "-" * 78,
+    ]
+    for identity, s in aggregates.by_identity.items():
+        lines.append(
+            f"{identity:<12} {s.total:>6} {s.failure_rate*100:>7.0f}% {s.length.mean:>10.0f} "
+            f"{s.tokens.mean:>10.0f} {s.latency.mean:>9.2f} {s.recent_latency_mean:>9.2f} "
+            f"{(s.latency.max if s.latency.count else 0):>9.2f}"
+        )
+
+    lines += ["", f"{'类别':<15} {'完成':>6} {'失败率':>8} {'平均长度':>10} {'平均延迟':>9}", "-" * 78]
+    for category, s in aggregates.by_category.items():
+        lines.append(
+            f"{category:<15} {s.total:>6} {s.failure_rate*100:>7.0f}% "
+            f"{s.length.mean:>10.0f} {s.latency.mean:>9.2f}"
+        )
+
+    alerts = aggregates.alerts()
+    if alerts:
+        lines += ["", "⚠️  告警:"] + [f"  - {a}" for a in alerts]
+    return "\n".join(lines)
+
+
+def follow(
+    results_file: str = "results.jsonl",
+    refresh_interval: float = 2.0,
+    chart_interval: float = 60.0,
+    idle_timeout: Optional[float] = None,
+    charts: bool = True
+) -> IncrementalAggregates:
+    """
+    跟踪运行中的实验
+
+    Args:
+        results_file: run_full_experiment 写出的 .jsonl 结果流
+        refresh_interval: 终端面板最短刷新间隔 (秒)
+        chart_interval: 图表最短重绘间隔 (秒)
+        idle_timeout: 超过该秒数没有新记录时退出，None 表示一直跟踪
+        charts: 是否定期重绘图表
+    """
+    full_path = os.path.join(os.path.dirname(__file__), results_file)
+    aggregates = IncrementalAggregates()
+    sketches = SketchSet()
+    plot_all = None
+    if charts:
+        from visualize import plot_all
+
+    last_refresh = 0.0
+    last_chart = time.time()
+    charted_total = 0
+
+    def refresh_dashboard():
+        print("\033[2J\033[H" + render_dashboard(aggregates, results_file), flush=True)
+
+    try:
+        for record in tail_records(full_path, idle_timeout=idle_timeout):
+            if record is RESTARTED:
+                aggregates = IncrementalAggregates()
+                sketches = SketchSet()
+                charted_total = 0
+            elif record is not None:
+                features = extract_features(record.get("response")) if record.get("success") else None
+                aggregates.add(record, features)
+                sketches.add(record)
+
+            now = time.time()
+            if now - last_refresh >= refresh_interval:
+                refresh_dashboard()
+                last_refresh = now
+            if plot_all and aggregates.successful > charted_total and now - last_chart >= chart_interval:
+                plot_all(None, sketches, aggregates)
+                charted_total = aggregates.successful
+                last_chart = now
+    except KeyboardInterrupt:
+        pass
+
+    refresh_dashboard()
+    if plot_all and aggregates.successful > charted_total:
+        plot_all(None, sketches, aggregates)
+    return aggregates
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="实时跟踪运行中的实验")
+    parser.add_argument("results_file", nargs="?", default="results.jsonl",
+                       help="run_full_experiment 写出的 .jsonl 结果流")
+    parser.add_argument("--refresh", type=float, default=2.0, help="终端面板刷新间隔 (秒)")
+    parser.add_argument("--chart-interval", type=float, default=60.0, help="图表重绘间隔 (秒)")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                       help="超过该秒数无新记录时退出")
+    parser.add_argument("--no-charts", action="store_true", help="只刷新终端面板，不重绘图表")
+
+    args = parser.parse_args()
+    follow(args.results_file, args.refresh, args.chart_interval, args.idle_timeout, not args.no_charts)
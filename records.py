@@ -0,0 +1,284 @@
+"""
+紧凑的内存结果表示
+身份、问题、类别等重复字符串驻留为共享查找表中的整数 id，
+数值字段按列存放在类型化数组中，单条记录以轻量视图按需访问
+"""
+
+import json
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class _Interner:
+    """把重复出现的值映射为连续整数 id"""
+
+    __slots__ = ("ids", "values")
+
+    def __init__(self):
+        self.ids: Dict = {}
+        self.values: List = []
+
+    def intern(self, value) -> int:
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = len(self.values)
+            self.ids[value] = idx
+            self.values.append(value)
+        return idx
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+# tz_offsets 中表示 "无时区信息" / "无时间戳" 的哨兵值
+_NAIVE = -(1 << 31)
+_NO_TIMESTAMP = -(1 << 63)
+
+
+def encode_timestamp(timestamp: Optional[str]):
+    """
+    ISO 时间字符串 → (距 epoch 的微秒数, UTC 偏移秒数)
+    不带时区的时间按墙上时间原样保存，偏移记为 _NAIVE，读回时不引入本地时区
+    """
+    if not timestamp:
+        return _NO_TIMESTAMP, _NAIVE
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        return (dt.replace(tzinfo=timezone.utc) - _EPOCH) // _MICROSECOND, _NAIVE
+    return (dt - _EPOCH) // _MICROSECOND, int(dt.utcoffset().total_seconds())
+
+
+def decode_timestamp(micros: int, offset: int) -> Optional[str]:
+    if micros == _NO_TIMESTAMP:
+        return None
+    dt = _EPOCH + timedelta(microseconds=micros)
+    if offset == _NAIVE:
+        return dt.replace(tzinfo=None).isoformat()
+    return dt.astimezone(timezone(timedelta(seconds=offset))).isoformat()
+
+
+class ResultRecord:
+    """
+    ResultTable 中单条记录的只读视图
+    支持与原始 dict 记录相同的 r["key"] / r.get("key") 访问方式
+    """
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table: "ResultTable", index: int):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key: str):
+        value = self._table._field(self._index, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default=None):
+        value = self._table._field(self._index, key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key: str) -> bool:
+        return self._table._field(self._index, key) is not _MISSING
+
+    def keys(self) -> List[str]:
+        keys = [k for k in ResultTable.FIELDS if k in self]
+        extra = self._table.extra.get(self._index)
+        return keys + list(extra) if extra else keys
+
+    def to_dict(self) -> Dict:
+        return {k: self[k] for k in self.keys()}
+
+    def __repr__(self) -> str:
+        return f"ResultRecord({self.to_dict()!r})"
+
+
+_MISSING = object()
+
+
+class ResultTable:
+    """
+    列式存储的实验结果表
+
+    - 身份 (identity_key, identity_name)、问题 (question_id, question)、
+      类别、难度、模型名驻留在共享查找表中，每条记录只存整数 id
+    - run_id、token 用量、延迟、成功标记等数值字段存放在 array 中
+    - 响应文本与错误信息按行存放，失败记录不占用响应字符串
+    - FIELDS 之外的字段 (variant、system_prompt_hash、ttft、quality 等) 稀疏存放在 extra 中
+    """
+
+    FIELDS = (
+        "identity_key", "identity_name", "question_id", "question", "category",
+        "difficulty", "run_id", "timestamp", "success", "response", "model",
+        "usage", "latency", "error"
+    )
+
+    def __init__(self):
+        self.identities = _Interner()   # (identity_key, identity_name)
+        self.questions = _Interner()    # (question_id, question)
+        self.categories = _Interner()
+        self.difficulties = _Interner()
+        self.models = _Interner()
+
+        self.identity_ids = array('I')
+        self.question_ids = array('I')
+        self.category_ids = array('H')
+        self.difficulty_ids = array('H')
+        self.model_ids = array('H')
+        self.run_ids = array('I')
+        self.timestamps = array('q')   # 距 epoch 的微秒数
+        self.tz_offsets = array('i')   # UTC 偏移秒数，_NAIVE 表示原始时间不带时区
+        self.success = array('b')
+        self.prompt_tokens = array('i')
+        self.completion_tokens = array('i')
+        self.total_tokens = array('i')
+        self.latencies = array('d')
+        self.response_lengths = array('I')
+
+        self.responses: List[Optional[str]] = []
+        self.errors: Dict[int, str] = {}
+        self.extra: Dict[int, Dict] = {}
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "ResultTable":
+        table = cls()
+        for record in records:
+            table.append(record)
+        return table
+
+    def append(self, record: Dict):
+        """追加一条 run_single_experiment 格式的记录"""
+        self.identity_ids.append(self.identities.intern((record["identity_key"], record["identity_name"])))
+        self.question_ids.append(self.questions.intern((record["question_id"], record["question"])))
+        self.category_ids.append(self.categories.intern(record["category"]))
+        self.difficulty_ids.append(self.difficulties.intern(record.get("difficulty")))
+        self.model_ids.append(self.models.intern(record.get("model")))
+        self.run_ids.append(record.get("run_id", 1))
+
+        micros, offset = encode_timestamp(record.get("timestamp"))
+        self.timestamps.append(micros)
+        self.tz_offsets.append(offset)
+
+        usage = record.get("usage") or {}
+        self.success.append(1 if record.get("success") else 0)
+        self.prompt_tokens.append(usage.get("prompt_tokens", 0))
+        self.completion_tokens.append(usage.get("completion_tokens", 0))
+        self.total_tokens.append(usage.get("total_tokens", 0))
+        self.latencies.append(record.get("latency", 0.0))
+
+        response = record.get("response")
+        self.responses.append(response)
+        self.response_lengths.append(len(response) if response else 0)
+
+        if "error" in record:
+            self.errors[len(self.responses) - 1] = record["error"]
+        others = {k: v for k, v in record.items() if k not in _FIELD_SET}
+        if others:
+            self.extra[len(self.responses) - 1] = others
+
+    def __len__(self) -> int:
+        return len(self.run_ids)
+
+    def __getitem__(self, index: int) -> ResultRecord:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ResultRecord(self, index)
+
+    def __iter__(self) -> Iterator[ResultRecord]:
+        for i in range(len(self)):
+            yield ResultRecord(self, i)
+
+    def to_records(self) -> List[Dict]:
+        return [r.to_dict() for r in self]
+
+    def _field(self, i: int, key: str):
+        if key == "identity_key":
+            return self.identities.values[self.identity_ids[i]][0]
+        if key == "identity_name":
+            return self.identities.values[self.identity_ids[i]][1]
+        if key == "question_id":
+            return self.questions.values[self.question_ids[i]][0]
+        if key == "question":
+            return self.questions.values[self.question_ids[i]][1]
+        if key == "category":
+            return self.categories.values[self.category_ids[i]]
+        if key == "difficulty":
+            return self.difficulties.values[self.difficulty_ids[i]]
+        if key == "run_id":
+            return self.run_ids[i]
+        if key == "timestamp":
+            return decode_timestamp(self.timestamps[i], self.tz_offsets[i])
+        if key == "success":
+            return bool(self.success[i])
+        if key == "response":
+            return self.responses[i]
+        if key == "error":
+            return self.errors.get(i, _MISSING)
+        if key not in _FIELD_SET:
+            return self.extra.get(i, {}).get(key, _MISSING)
+
+        # 以下字段仅在成功记录上存在，与 get_response 的返回格式一致
+        if not self.success[i]:
+            return _MISSING
+        if key == "model":
+            return self.models.values[self.model_ids[i]]
+        if key == "usage":
+            return {
+                "prompt_tokens": self.prompt_tokens[i],
+                "completion_tokens": self.completion_tokens[i],
+                "total_tokens": self.total_tokens[i]
+            }
+        if key == "latency":
+            return self.latencies[i]
+        return _MISSING
+
+
+_FIELD_SET = frozenset(ResultTable.FIELDS)
+
+
+def iter_results(full_path: str) -> Iterator[Dict]:
+    """
+    逐条读取结果文件，支持 JSON 数组、JSONL 与 .store 归档三种格式
+    JSONL 按行流式读取；JSON 数组按对象逐个解码，不会一次性构造全部 dict
+    """
+    from storage import is_store, iter_store
+    if is_store(full_path):
+        yield from iter_store(full_path)
+        return
+
+    with open(full_path, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if first != '[':
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        text = f.read()
+
+    decoder = json.JSONDecoder()
+    pos = 0
+    end = len(text)
+    while pos < end:
+        while pos < end and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= end or text[pos] == ']':
+            return
+        obj, pos = decoder.raw_decode(text, pos)
+        yield obj
+
+
+def load_table(full_path: str) -> ResultTable:
+    """将结果文件直接读入紧凑的 ResultTable；.store 归档直接由规范化的表构造"""
+    from storage import ResultStore, is_store
+    if is_store(full_path):
+        return ResultStore(full_path).to_table()
+    return ResultTable.from_records(iter_results(full_path))
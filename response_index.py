@@ -0,0 +1,311 @@
+"""
+结果文件的持久化索引
+- 按 (question_id, identity_key, run_id) 记录每条结果在文件中的字节偏移，
+  通过 mmap 实现 O(1) 随机读取；.store 归档按行号索引，经 ResultStore.record 读取
+- 对响应文本建立倒排索引，中文按相邻字符二元组 (bigram) 切分，其余按单词切分
+索引保存在结果文件旁的 <results>.idx 中，结果文件变化后自动重建
+"""
+
+import json
+import mmap
+import os
+import pickle
+import re
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from storage import ResultStore, is_store
+
+INDEX_VERSION = 1
+
+_CJK = r"㐀-䶿一-鿿豈-﫿"
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[0-9A-Za-z_]+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    CJK 感知的分词：连续汉字切为字符二元组 (单个汉字保留为一元组)，
+    英文与数字按单词切分并转为小写
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text or ""):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def _iter_spans(data: bytes) -> Iterator[Tuple[int, int, Dict]]:
+    """
+    逐条产出 (字节偏移, 字节长度, 记录)，支持 JSON 数组与 JSONL
+    """
+    start = 0
+    while start < len(data) and data[start:start + 1].isspace():
+        start += 1
+
+    if data[start:start + 1] != b'[':
+        offset = 0
+        for line in data.splitlines(keepends=True):
+            stripped = line.rstrip(b"\r\n")
+            if stripped.strip():
+                yield offset, len(stripped), json.loads(stripped)
+            offset += len(line)
+        return
+
+    # JSON 数组：按字符解码，同时累加已跳过片段的 UTF-8 字节数换算字节偏移
+    text = data.decode('utf-8')
+    decoder = json.JSONDecoder()
+    pos = text.index('[') + 1
+    byte_pos = len(text[:pos].encode('utf-8'))
+    end = len(text)
+    while True:
+        skip_start = pos
+        while pos < end and text[pos] in " \t\r\n,":
+            pos += 1
+        byte_pos += pos - skip_start
+        if pos >= end or text[pos] == ']':
+            return
+        obj, new_pos = decoder.raw_decode(text, pos)
+        length = len(text[pos:new_pos].encode('utf-8'))
+        yield byte_pos, length, obj
+        byte_pos += length
+        pos = new_pos
+
+
+class ResponseIndex:
+    """
+    结果文件的元数据索引 + 响应全文倒排索引
+    """
+
+    def __init__(self, results_path: str):
+        self.results_path = results_path
+        self.index_path = results_path + ".idx"
+        self.source_stat: Tuple[int, int] = (0, 0)
+
+        self.keys: Dict[Tuple[str, str, int], int] = {}
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.identity_keys: List[str] = []
+        self.identity_ids = array('I')
+        self.by_question: Dict[str, array] = {}
+        self.postings: Dict[str, array] = {}
+
+        self._file = None
+        self._mm = None
+        self._store: Optional[ResultStore] = None
+
+    # ---------- 构建与持久化 ----------
+
+    @classmethod
+    def build(cls, results_path: str) -> "ResponseIndex":
+        index = cls(results_path)
+        if is_store(results_path):
+            # 归档中的记录没有独立的字节区间，偏移处存放行号
+            with ResultStore(results_path) as store:
+                index._add_all((n, 0, store.record(n)) for n in range(len(store)))
+        else:
+            with open(results_path, 'rb') as f:
+                data = f.read()
+            index._add_all(_iter_spans(data))
+        index.source_stat = cls._stat(results_path)
+        return index
+
+    def _add_all(self, spans: Iterator[Tuple[int, int, Dict]]):
+        identity_lookup = {}
+        by_question = defaultdict(lambda: array('I'))
+        postings = defaultdict(lambda: array('I'))
+
+        for n, (offset, length, record) in enumerate(spans):
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.keys[(record["question_id"], record["identity_key"], record.get("run_id", 1))] = n
+
+            identity_key = record["identity_key"]
+            if identity_key not in identity_lookup:
+                identity_lookup[identity_key] = len(self.identity_keys)
+                self.identity_keys.append(identity_key)
+            self.identity_ids.append(identity_lookup[identity_key])
+            by_question[record["question_id"]].append(n)
+
+            if record.get("success"):
+                for token in set(tokenize(record.get("response"))):
+                    postings[token].append(n)
+
+        self.by_question = dict(by_question)
+        self.postings = dict(postings)
+
+    @staticmethod
+    def _stat(results_path: str) -> Tuple[int, int]:
+        st = os.stat(results_path)
+        return st.st_size, st.st_mtime_ns
+
+    def save(self):
+        state = {
+            "version": INDEX_VERSION,
+            "source_stat": self.source_stat,
+            "keys": self.keys,
+            "offsets": self.offsets,
+            "lengths": self.lengths,
+            "identity_keys": self.identity_keys,
+            "identity_ids": self.identity_ids,
+            "by_question": self.by_question,
+            "postings": self.postings,
+        }
+        with open(self.index_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def open(cls, results_path: str, rebuild: bool = False) -> "ResponseIndex":
+        """
+        打开结果文件的索引；索引不存在、版本不符或结果文件已变化时重建
+        """
+        index = cls(results_path)
+        state = None
+        if not rebuild and os.path.exists(index.index_path):
+            with open(index.index_path, 'rb') as f:
+                state = pickle.load(f)
+            if state.get("version") != INDEX_VERSION or tuple(state["source_stat"]) != cls._stat(results_path):
+                state = None
+
+        if state is None:
+            index = cls.build(results_path)
+            index.save()
+        else:
+            state.pop("version")
+            for key, value in state.items():
+                setattr(index, key, value)
+            index.source_stat = tuple(index.source_stat)
+        return index
+
+    # ---------- 随机读取 ----------
+
+    def _read(self, n: int) -> Dict:
+        if self._store is None and self._mm is None:
+            if is_store(self.results_path):
+                self._store = ResultStore(self.results_path)
+            else:
+                self._file = open(self.results_path, 'rb')
+                self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._store is not None:
+            return self._store.record(self.offsets[n])
+        offset = self.offsets[n]
+        return json.loads(self._mm[offset:offset + self.lengths[n]])
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, question_id: str, identity_key: str, run_id: int = 1) -> Optional[Dict]:
+        n = self.keys.get((question_id, identity_key, run_id))
+        return None if n is None else self._read(n)
+
+    def question(self, question_id: str) -> List[Dict]:
+        """某个问题在所有身份与运行下的记录"""
+        return [self._read(n) for n in self.by_question.get(question_id, ())]
+
+    # ---------- 全文检索 ----------
+
+    def _postings_for(self, token: str):
+        posting = self.postings.get(token)
+        if posting is not None:
+            return posting
+        # 单个汉字的查询词：合并所有包含该字的二元组的倒排表
+        if len(token) == 1 and _CJK_RE.match(token):
+            merged = set()
+            for key, posting in self.postings.items():
+                if token in key:
+                    merged.update(posting)
+            return sorted(merged)
+        return ()
+
+    def _candidates(self, query: str) -> List[int]:
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        lists = sorted((self._postings_for(t) for t in tokens), key=len)
+        if not lists[0]:
+            return []
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return sorted(candidates)
+
+    def search(self, query: str, identities: List[str] = None) -> Dict[str, List[Dict]]:
+        """
+        检索响应中包含 query 的记录，按身份分组返回
+        先以倒排索引求交得到候选，再读取原文确认确实包含完整的 query
+        """
+        wanted = set(identities) if identities else None
+        needle = query.lower()
+        hits = defaultdict(list)
+        for n in self._candidates(query):
+            identity_key = self.identity_keys[self.identity_ids[n]]
+            if wanted is not None and identity_key not in wanted:
+                continue
+            record = self._read(n)
+            if needle in (record.get("response") or "").lower():
+                hits[identity_key].append(record)
+        return dict(hits)
+
+
+def open_index(file_path: str = "results.json", rebuild: bool = False) -> ResponseIndex:
+    """打开 (必要时构建) 与 analysis.load_results 相同路径约定的结果文件索引"""
+    full_path = os.path.join(os.path.dirname(__file__), file_path)
+    return ResponseIndex.open(full_path, rebuild=rebuild)
+
+
+def print_search_results(index: ResponseIndex, query: str, identities: List[str] = None):
+    """
+    打印关键词检索结果
+    """
+    hits = index.search(query, identities)
+    total = sum(len(v) for v in hits.values())
+
+    print(f"\n🔎 检索: {query}  (命中 {total} 条)")
+    print("=" * 70)
+    for identity_key, records in hits.items():
+        print(f"\n👤 {records[0]['identity_name']} ({identity_key}): {len(records)} 条")
+        for r in records:
+            response = r["response"]
+            pos = response.lower().find(query.lower())
+            snippet = response[max(0, pos - 30):pos + len(query) + 30].replace("\n", " ")
+            print(f"   - {r['question_id']} #{r.get('run_id', 1)}: ...{snippet}...")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="结果文件索引与全文检索")
+    parser.add_argument("results_file", help="结果文件 (JSON 数组、JSONL 或 .store 归档)")
+    parser.add_argument("--search", type=str, help="检索响应文本中的关键词")
+    parser.add_argument("--identity", type=str, nargs="*", help="仅检索这些身份")
+    parser.add_argument("--rebuild", action="store_true", help="强制重建索引")
+
+    args = parser.parse_args()
+
+    with open_index(args.results_file, rebuild=args.rebuild) as index:
+        print(f"✅ 索引就绪: {index.index_path} ({len(index)} 条记录, {len(index.postings)} 个词项)")
+        if args.search:
+            print_search_results(index, args.search, args.identity)
@@ -0,0 +1,252 @@
+"""
+常驻本地查询服务
+保持 OpenAI 连接与响应缓存常驻内存，将一个问题并发分发给多个身份，
+并以 NDJSON 流的形式按完成顺序逐个返回各身份的回答
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+
+from config import IDENTITIES, EXPERIMENT_PARAMS
+from experiment import get_response
+from records import iter_results
+
+
+class ResponseCache:
+    """
+    线程安全的响应缓存，键为 (身份, 问题, temperature, max_tokens)
+    """
+
+    def __init__(self):
+        self._entries: Dict[tuple, Dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(identity_key: str, question: str, temperature: float, max_tokens: int) -> tuple:
+        return (identity_key, question, float(temperature), int(max_tokens))
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: tuple, result: Dict):
+        with self._lock:
+            self._entries[key] = result
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def preload(self, file_path: str) -> int:
+        """从已有的实验结果文件 (JSON 数组 / JSONL / .store) 预热缓存，返回载入条数"""
+        full_path = os.path.join(os.path.dirname(__file__), file_path)
+        if not os.path.exists(full_path):
+            return 0
+
+        loaded = 0
+        for r in iter_results(full_path):
+            if not r.get("success"):
+                continue
+            key = self.make_key(
+                r["identity_key"], r["question"],
+                EXPERIMENT_PARAMS["temperature"], EXPERIMENT_PARAMS["max_tokens"]
+            )
+            self.put(key, {
+                "success": True,
+                "response": r["response"],
+                "model": r.get("model"),
+                "usage": r.get("usage", {}),
+                "latency": r.get("latency", 0)
+            })
+            loaded += 1
+        return loaded
+
+
+class IdentityService:
+    """
+    将问题并发分发给多个身份
+    复用 experiment 模块中的全局 OpenAI 客户端，底层 HTTP 连接池在请求间保持常驻
+    线程池按 身份数 x 并发客户端数 分配，多个客户端同时提问时互不排队
+    """
+
+    def __init__(self, max_workers: int = None, cache: ResponseCache = None, max_clients: int = 8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(IDENTITIES) * max_clients)
+        self.cache = cache if cache is not None else ResponseCache()
+
+    def _ask_one(self, identity_key: str, question: str, temperature: float,
+                 max_tokens: int, refresh: bool) -> Dict:
+        key = ResponseCache.make_key(identity_key, question, temperature, max_tokens)
+        cached = None if refresh else self.cache.get(key)
+        if cached is not None:
+            result = {**cached, "cached": True}
+        else:
+            result = get_response(identity_key, question, temperature=temperature, max_tokens=max_tokens)
+            if result["success"]:
+                self.cache.put(key, result)
+            result = {**result, "cached": False}
+
+        return {
+            "identity_key": identity_key,
+            "identity_name": IDENTITIES[identity_key]["name"],
+            **result
+        }
+
+    def ask(
+        self,
+        question: str,
+        identities: List[str] = None,
+        temperature: float = None,
+        max_tokens: int = None,
+        refresh: bool = False
+    ) -> Iterator[Dict]:
+        """
+        并发询问多个身份，按完成顺序逐个产出结果
+
+        Args:
+            question: 问题文本
+            identities: 身份列表，None 表示全部
+            temperature: 采样温度，None 使用实验默认值
+            max_tokens: 最大生成长度，None 使用实验默认值
+            refresh: 为 True 时忽略缓存强制重新请求
+        """
+        if identities is None:
+            identities = list(IDENTITIES.keys())
+        if temperature is None:
+            temperature = EXPERIMENT_PARAMS["temperature"]
+        if max_tokens is None:
+            max_tokens = EXPERIMENT_PARAMS["max_tokens"]
+
+        futures = [
+            self.executor.submit(self._ask_one, identity_key, question, temperature, max_tokens, refresh)
+            for identity_key in identities
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET  /identities  列出可用身份
+    POST /ask         {"question": ..., "identities": [...], "refresh": false}
+                      以 application/x-ndjson 分块流式返回，每行一个身份的结果
+    """
+
+    service: IdentityService = None
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/identities":
+            self._send_json(200, {k: v["name"] for k, v in IDENTITIES.items()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/ask":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": f"invalid JSON: {e}"})
+            return
+
+        # 开始分块响应后无法再返回错误状态，所有参数必须先校验
+        if not isinstance(payload, dict):
+            self._send_json(400, {"error": "request body must be a JSON object"})
+            return
+        question = payload.get("question")
+        identities = payload.get("identities")
+        if not question or not isinstance(question, str):
+            self._send_json(400, {"error": "missing 'question'"})
+            return
+        if identities is not None and not (
+                isinstance(identities, list) and all(isinstance(i, str) for i in identities)):
+            self._send_json(400, {"error": "'identities' must be a list of identity keys"})
+            return
+        unknown = [i for i in (identities or []) if i not in IDENTITIES]
+        if unknown:
+            self._send_json(400, {"error": f"unknown identities: {unknown}"})
+            return
+        for field in ("temperature", "max_tokens"):
+            value = payload.get(field)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                self._send_json(400, {"error": f"'{field}' must be a number"})
+                return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for result in self.service.ask(
+            question,
+            identities=identities,
+            temperature=payload.get("temperature"),
+            max_tokens=payload.get("max_tokens"),
+            refresh=bool(payload.get("refresh", False))
+        ):
+            line = json.dumps(result, ensure_ascii=False) + "\n"
+            self._write_chunk(line.encode('utf-8'))
+        self._write_chunk(b"")
+
+    def log_message(self, format, *args):
+        print(f"  [{self.address_string()}] {format % args}")
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, preload: List[str] = None, max_clients: int = 8):
+    """
+    启动常驻查询服务
+    """
+    cache = ResponseCache()
+    for file_path in preload or []:
+        loaded = cache.preload(file_path)
+        print(f"📦 从 {file_path} 预载 {loaded} 条缓存响应")
+
+    _Handler.service = IdentityService(cache=cache, max_clients=max_clients)
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+
+    print(f"=" * 60)
+    print(f"🛰️  Identity 查询服务已启动: http://{host}:{port}")
+    print(f"可用身份: {list(IDENTITIES.keys())}")
+    print(f"=" * 60)
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 服务已停止")
+    finally:
+        httpd.server_close()
+        _Handler.service.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Identity Prompt Engineering 常驻查询服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--preload", type=str, nargs="*", default=["demo_results.json"],
+                       help="用于预热缓存的结果文件")
+    parser.add_argument("--max-clients", type=int, default=8,
+                       help="预期同时提问的客户端数，用于确定线程池大小")
+
+    args = parser.parse_args()
+    serve(args.host, args.port, args.preload, args.max_clients)
@@ -0,0 +1,277 @@
+"""
+可合并的分位数草图
+延迟、首 token 延迟 (TTFT) 与 token 数按对数分桶计数 (DDSketch / HDR 直方图思路)，
+分位数相对误差有界，草图之间按桶相加即可精确合并
+草图序列化在结果文件旁的 <results>.sketch.json 中
+"""
+
+import json
+import math
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from records import iter_results
+
+SKETCH_VERSION = 1
+
+# (指标名, 从记录取值的函数)；TTFT 只在记录带有 ttft 字段时统计
+METRICS = {
+    "latency": lambda r: r.get("latency"),
+    "ttft": lambda r: r.get("ttft"),
+    "tokens": lambda r: r.get("usage", {}).get("total_tokens"),
+    "completion_tokens": lambda r: r.get("usage", {}).get("completion_tokens"),
+}
+
+# 分组维度
+DIMENSIONS = ("all", "identity", "category")
+
+
+class QuantileSketch:
+    """
+    对数分桶的分位数草图
+    桶 i 覆盖 (gamma^(i-1), gamma^i]，gamma = (1 + a) / (1 - a)，
+    以桶的加权中点估计分位数时相对误差不超过 a
+    """
+
+    __slots__ = ("relative_accuracy", "gamma", "_log_gamma", "buckets", "zeros",
+                 "count", "sum", "min", "max")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = defaultdict(int)
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, weight: int = 1):
+        if value is None:
+            return
+        value = float(value)
+        if value <= 0:
+            self.zeros += weight
+        else:
+            self.buckets[math.ceil(math.log(value) / self._log_gamma)] += weight
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "QuantileSketch"):
+        """按桶相加合并，结果与对全部样本直接建草图完全一致"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("只能合并精度相同的草图")
+        for index, n in other.buckets.items():
+            self.buckets[index] += n
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                estimate = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs: Iterable[float]) -> List[float]:
+        return [self.quantile(q) for q in qs]
+
+    def to_dict(self) -> Dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": {str(k): v for k, v in sorted(self.buckets.items())},
+            "zeros": self.zeros,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "QuantileSketch":
+        sketch = cls(data["relative_accuracy"])
+        sketch.buckets.update({int(k): v for k, v in data["buckets"].items()})
+        sketch.zeros = data["zeros"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        sketch.min = data["min"] if data["min"] is not None else math.inf
+        sketch.max = data["max"] if data["max"] is not None else -math.inf
+        return sketch
+
+
+class SketchSet:
+    """
+    按 (指标, 维度, 分组) 组织的一组草图，只统计成功的记录
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.records = 0
+        self.sketches: Dict[Tuple[str, str, str], QuantileSketch] = {}
+
+    def _sketch(self, key: Tuple[str, str, str]) -> QuantileSketch:
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = QuantileSketch(self.relative_accuracy)
+        return sketch
+
+    def add(self, record: Dict):
+        self.records += 1
+        if not record.get("success"):
+            return
+        groups = {
+            "all": "all",
+            "identity": record["identity_name"],
+            "category": record["category"],
+        }
+        for metric, extract in METRICS.items():
+            value = extract(record)
+            if value is None:
+                continue
+            for dimension in DIMENSIONS:
+                self._sketch((metric, dimension, groups[dimension])).add(value)
+
+    def update(self, records: Iterable[Dict]) -> "SketchSet":
+        for record in records:
+            self.add(record)
+        return self
+
+    def merge(self, other: "SketchSet"):
+        self.records += other.records
+        for key, sketch in other.sketches.items():
+            self._sketch(key).merge(sketch)
+
+    def get(self, metric: str, dimension: str = "all", group: str = "all") -> Optional[QuantileSketch]:
+        return self.sketches.get((metric, dimension, group))
+
+    def groups(self, metric: str, dimension: str) -> Dict[str, QuantileSketch]:
+        """某指标在某维度下的 {分组: 草图}，保持首次出现的顺序"""
+        return {g: s for (m, d, g), s in self.sketches.items() if m == metric and d == dimension}
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": SKETCH_VERSION,
+            "relative_accuracy": self.relative_accuracy,
+            "records": self.records,
+            "sketches": [
+                {"metric": m, "dimension": d, "group": g, **s.to_dict()}
+                for (m, d, g), s in self.sketches.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SketchSet":
+        sketch_set = cls(data["relative_accuracy"])
+        sketch_set.records = data["records"]
+        for entry in data["sketches"]:
+            key = (entry["metric"], entry["dimension"], entry["group"])
+            sketch_set.sketches[key] = QuantileSketch.from_dict(entry)
+        return sketch_set
+
+    def save(self, full_path: str):
+        with open(full_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, full_path: str) -> "SketchSet":
+        with open(full_path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+def sketch_path(results_path: str) -> str:
+    """结果文件对应的草图文件路径: results.json -> results.sketch.json"""
+    return os.path.splitext(results_path)[0] + ".sketch.json"
+
+
+def load_sketches(file_path: str = "results.json", rebuild: bool = False) -> SketchSet:
+    """
+    读取结果文件旁的草图；不存在、比结果文件旧或指定 rebuild 时从结果重建并保存
+    """
+    full_path = os.path.join(os.path.dirname(__file__), file_path)
+    path = sketch_path(full_path)
+    if not rebuild and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(full_path):
+        return SketchSet.load(path)
+
+    sketches = SketchSet().update(iter_results(full_path))
+    sketches.save(path)
+    return sketches
+
+
+def report_sketches(file_path: str, fallback: SketchSet, sketch_files: List[str] = None) -> SketchSet:
+    """
+    报告使用的分位数草图:
+    指定 sketch_files 时合并这些文件 (例如各分片的草图)；否则结果文件旁的草图
+    不比结果文件旧时使用它 (可能已由 sketch.py merge 合并了其他分片)；都没有时使用 fallback
+    """
+    base_dir = os.path.dirname(__file__)
+    if sketch_files:
+        sketches = merge_sketch_files([os.path.join(base_dir, p) for p in sketch_files])
+        print(f"📐 分位数来自 {len(sketch_files)} 个草图文件 ({sketches.records} 条记录)")
+        return sketches
+
+    full_path = os.path.join(base_dir, file_path)
+    path = sketch_path(full_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(full_path):
+        sketches = SketchSet.load(path)
+        print(f"📐 分位数来自草图文件 {os.path.relpath(path, base_dir)} ({sketches.records} 条记录)")
+        return sketches
+    return fallback
+
+
+def merge_sketch_files(paths: List[str]) -> SketchSet:
+    """合并多个分片 / 增量运行的草图文件"""
+    merged = None
+    for path in paths:
+        sketches = SketchSet.load(path)
+        if merged is None:
+            merged = sketches
+        else:
+            merged.merge(sketches)
+    return merged if merged is not None else SketchSet()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="结果分位数草图")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="从结果文件构建草图")
+    build_parser.add_argument("results_file", help="结果文件 (JSON 数组或 JSONL)")
+
+    merge_parser = subparsers.add_parser("merge", help="合并多个草图文件")
+    merge_parser.add_argument("output", help="合并后的草图文件")
+    merge_parser.add_argument("inputs", nargs="+", help="待合并的草图文件")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        sketches = load_sketches(args.results_file, rebuild=True)
+        print(f"✅ 已构建草图: {sketch_path(args.results_file)} ({sketches.records} 条记录)")
+    else:
+        merged = merge_sketch_files(args.inputs)
+        merged.save(args.output)
+        print(f"✅ 已合并 {len(args.inputs)} 个草图: {args.output} ({merged.records} 条记录)")
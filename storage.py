@@ -0,0 +1,483 @@
+"""
+规范化的结果归档格式 (.store)
+问题表与身份表各存一次文本及其 prompt 内容哈希，结果表只按 id 引用它们；
+响应文本逐条用共享字典压缩存放在 blob 段中，只在真正读取文本时解压
+
+文件布局:
+    MAGIC | 共享字典 | 响应 blob 段 | 压缩的 JSON 清单 | 尾部 (清单偏移, 字典长度)
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from config import IDENTITIES
+from records import ResultTable, encode_timestamp, iter_results
+from variants import PersonaGrammar
+
+MAGIC = b"IPESTORE\x01\n"
+STORE_VERSION = 2
+
+# zlib 的回溯窗口为 32KB，更长的字典不会被用到
+DICTIONARY_SIZE = 32 * 1024
+# 用于训练共享字典的响应条数，以及为此最多缓存的开头记录数
+DICTIONARY_SAMPLES = 256
+DICTIONARY_HEAD_LIMIT = 2048
+COMPRESSION_LEVEL = 9
+
+_TRAILER = struct.Struct("<QQ")
+
+# 以表 / 列形式存放的记录字段，其余字段原样保存在 extra 中
+_RECORD_FIELDS = {
+    "identity_key", "identity_name", "variant", "question_id", "question", "category",
+    "difficulty", "run_id", "timestamp", "success", "response", "error", "model", "usage", "latency",
+    "system_prompt", "system_prompt_hash",
+}
+
+
+def prompt_hash(text: Optional[str]) -> Optional[str]:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest() if text is not None else None
+
+
+def is_store(full_path: str) -> bool:
+    with open(full_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def build_dictionary(samples: List[str], size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    由样本响应训练共享字典
+    在多条响应中重复出现的行 (Markdown 标题、免责声明等) 优先，
+    出现越多越靠近字典末尾 (距离越近，deflate 的匹配代价越低)；剩余空间用样本文本填充
+    """
+    counts = Counter()
+    for text in samples:
+        counts.update({line.strip() for line in text.splitlines() if len(line.strip()) >= 4})
+
+    common = [line for line, n in sorted(counts.items(), key=lambda item: item[1]) if n >= 2]
+    tail = "\n".join(common).encode('utf-8')[-size:]
+
+    filler = b""
+    budget = size - len(tail)
+    for text in samples:
+        if len(filler) >= budget:
+            break
+        filler += text.encode('utf-8')[:2048] + b"\n"
+    return filler[:budget] + tail
+
+
+class _BlobWriter:
+    def __init__(self, f, dictionary: bytes):
+        self.f = f
+        self.dictionary = dictionary
+
+    def write(self, text: str):
+        """写入一条响应，返回 (偏移, 压缩长度)"""
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY,
+                                      self.dictionary)
+        blob = compressor.compress(text.encode('utf-8')) + compressor.flush()
+        offset = self.f.tell()
+        self.f.write(blob)
+        return offset, len(blob)
+
+
+def _config_prompt(record: Dict, grammar: PersonaGrammar) -> Optional[str]:
+    """按当前的变体文法或 config.IDENTITIES 重建的 system prompt (可能已与生成时不同)"""
+    levels = record.get("variant")
+    if levels:
+        try:
+            choice = [grammar.level_keys[i].index(levels[name]) for i, name in enumerate(grammar.factor_names)]
+        except (KeyError, ValueError):
+            return None
+        return grammar.variant(choice).system_prompt
+    identity = IDENTITIES.get(record["identity_key"])
+    return identity["system_prompt"] if identity else None
+
+
+def _prompt_info(record: Dict, grammar: PersonaGrammar) -> Dict:
+    """
+    身份表中的 prompt 字段
+    - 记录带有 system_prompt 原文: 直接使用，prompt_source = "recorded"
+    - 记录带有 system_prompt_hash: 哈希为准；当前配置重建的 prompt 哈希一致时才保存原文，
+      否则原文为 null，prompt_source = "recorded"
+    - 旧记录两者都没有: 哈希为 null，当前配置重建的 prompt 只作为 inferred_prompt 参考，
+      prompt_source = "inferred" (无法重建时为 "unknown")
+    """
+    text = record.get("system_prompt")
+    if text is not None:
+        return {"system_prompt": text, "prompt_hash": prompt_hash(text), "prompt_source": "recorded"}
+    candidate = _config_prompt(record, grammar)
+    recorded_hash = record.get("system_prompt_hash")
+    if recorded_hash is not None:
+        verified = candidate if candidate is not None and prompt_hash(candidate) == recorded_hash else None
+        return {"system_prompt": verified, "prompt_hash": recorded_hash, "prompt_source": "recorded"}
+    if candidate is None:
+        return {"system_prompt": None, "prompt_hash": None, "prompt_source": "unknown"}
+    return {"system_prompt": None, "prompt_hash": None, "prompt_source": "inferred", "inferred_prompt": candidate}
+
+
+def write_store(records: Iterable[Dict], full_path: str) -> Dict:
+    """
+    把结果记录写成 .store 归档，记录流只遍历一次
+
+    Returns:
+        写入统计 (记录数、原始响应字节数、压缩后字节数、文件大小)
+    """
+    records = iter(records)
+    grammar = PersonaGrammar.from_config()
+
+    # 先缓存开头一批记录训练字典 (至多 DICTIONARY_HEAD_LIMIT 条)，之后的记录直接流式写入
+    head = []
+    samples = []
+    for record in records:
+        head.append(record)
+        if record.get("success") and record.get("response"):
+            samples.append(record["response"])
+        if len(samples) >= DICTIONARY_SAMPLES or len(head) >= DICTIONARY_HEAD_LIMIT:
+            break
+    dictionary = build_dictionary(samples)
+
+    questions: Dict[tuple, int] = {}
+    identities: Dict[tuple, int] = {}
+    models: Dict[Optional[str], int] = {}
+    question_rows: List[Dict] = []
+    identity_rows: List[Dict] = []
+    columns = {name: [] for name in (
+        "identity", "question", "model", "run_id", "timestamp", "success", "prompt_tokens",
+        "completion_tokens", "total_tokens", "latency", "response_offset", "response_size", "response_chars",
+    )}
+    errors: Dict[str, str] = {}
+    extra: Dict[str, Dict] = {}
+    raw_bytes = 0
+
+    def intern(table: Dict, rows: List[Dict], key: tuple, row: Dict) -> int:
+        idx = table.get(key)
+        if idx is None:
+            idx = table[key] = len(rows)
+            rows.append(row)
+        return idx
+
+    tmp_path = full_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(dictionary)
+        blobs = _BlobWriter(f, dictionary)
+
+        for n, record in enumerate(_chain(head, records)):
+            prompt = _prompt_info(record, grammar)
+            inline = ("system_prompt" in record, "system_prompt_hash" in record)
+            variant = record.get("variant")
+            columns["identity"].append(intern(
+                identities, identity_rows,
+                (record["identity_key"], record["identity_name"], prompt["prompt_hash"],
+                 prompt["system_prompt"], prompt.get("inferred_prompt"), inline),
+                {
+                    "identity_key": record["identity_key"],
+                    "identity_name": record["identity_name"],
+                    **prompt,
+                    "inline_prompt": inline[0],
+                    "inline_hash": inline[1],
+                    **({"variant": variant} if variant is not None else {}),
+                }
+            ))
+            columns["question"].append(intern(
+                questions, question_rows,
+                (record["question_id"], record["question"], record["category"], record.get("difficulty")),
+                {
+                    "question_id": record["question_id"],
+                    "question": record["question"],
+                    "category": record["category"],
+                    "difficulty": record.get("difficulty"),
+                    "prompt_hash": prompt_hash(record["question"]),
+                }
+            ))
+            columns["model"].append(models.setdefault(record.get("model"), len(models)))
+            columns["run_id"].append(record.get("run_id", 1))
+            columns["timestamp"].append(record.get("timestamp"))
+            columns["success"].append(1 if record.get("success") else 0)
+
+            usage = record.get("usage") or {}
+            columns["prompt_tokens"].append(usage.get("prompt_tokens", 0))
+            columns["completion_tokens"].append(usage.get("completion_tokens", 0))
+            columns["total_tokens"].append(usage.get("total_tokens", 0))
+            columns["latency"].append(record.get("latency", 0.0))
+
+            response = record.get("response")
+            if response is None:
+                offset, size, chars = 0, -1, 0
+            else:
+                offset, size = blobs.write(response)
+                chars = len(response)
+                raw_bytes += len(response.encode('utf-8'))
+            columns["response_offset"].append(offset)
+            columns["response_size"].append(size)
+            columns["response_chars"].append(chars)
+
+            if "error" in record:
+                errors[str(n)] = record["error"]
+            others = {k: v for k, v in record.items() if k not in _RECORD_FIELDS}
+            if others:
+                extra[str(n)] = others
+
+        blob_bytes = f.tell() - len(MAGIC) - len(dictionary)
+        manifest = {
+            "version": STORE_VERSION,
+            "codec": "zlib-raw+zdict",
+            "questions": question_rows,
+            "identities": identity_rows,
+            "models": list(models),
+            "results": columns,
+            "errors": errors,
+            "extra": extra,
+        }
+        manifest_offset = f.tell()
+        f.write(zlib.compress(json.dumps(manifest, ensure_ascii=False).encode('utf-8'), COMPRESSION_LEVEL))
+        f.write(_TRAILER.pack(manifest_offset, len(dictionary)))
+        file_size = f.tell()
+    os.replace(tmp_path, full_path)
+
+    return {
+        "records": len(columns["run_id"]),
+        "questions": len(question_rows),
+        "identities": len(identity_rows),
+        "response_bytes": raw_bytes,
+        "blob_bytes": blob_bytes,
+        "file_size": file_size,
+    }
+
+
+def _chain(head: List[Dict], rest: Iterator[Dict]) -> Iterator[Dict]:
+    yield from head
+    yield from rest
+
+
+class _LazyResponses(Sequence):
+    """按需解压的响应文本序列，可直接作为 ResultTable.responses"""
+
+    def __init__(self, store: "ResultStore"):
+        self._store = store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, i):
+        return self._store.response(i)
+
+
+class ResultStore:
+    """
+    打开的 .store 归档
+    问题表、身份表与结果列在打开时读入；响应文本通过 mmap 随机读取并按条解压
+    """
+
+    def __init__(self, full_path: str):
+        self.full_path = full_path
+        self._file = open(full_path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"不是结果归档文件: {full_path}")
+
+        manifest_offset, dictionary_size = _TRAILER.unpack(self._mm[-_TRAILER.size:])
+        manifest = json.loads(zlib.decompress(self._mm[manifest_offset:len(self._mm) - _TRAILER.size]))
+        if manifest["version"] != STORE_VERSION:
+            self.close()
+            raise ValueError(f"不支持的归档版本: {manifest['version']}")
+
+        self.dictionary = self._mm[len(MAGIC):len(MAGIC) + dictionary_size]
+        self.questions: List[Dict] = manifest["questions"]
+        self.identities: List[Dict] = manifest["identities"]
+        self.models: List[Optional[str]] = manifest["models"]
+        self.columns: Dict[str, List] = manifest["results"]
+        self.errors = {int(k): v for k, v in manifest["errors"].items()}
+        self.extra = {int(k): v for k, v in manifest["extra"].items()}
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.columns["run_id"])
+
+    def response(self, i: int) -> Optional[str]:
+        size = self.columns["response_size"][i]
+        if size < 0:
+            return None
+        offset = self.columns["response_offset"][i]
+        decompressor = zlib.decompressobj(-15, zdict=self.dictionary)
+        return (decompressor.decompress(self._mm[offset:offset + size]) + decompressor.flush()).decode('utf-8')
+
+    @staticmethod
+    def _identity_fields(identity: Dict) -> Dict:
+        """身份级别上存储、但需要回填到每条记录中的字段"""
+        fields = {}
+        if "variant" in identity:
+            fields["variant"] = identity["variant"]
+        if identity["inline_prompt"]:
+            fields["system_prompt"] = identity["system_prompt"]
+        if identity["inline_hash"]:
+            fields["system_prompt_hash"] = identity["prompt_hash"]
+        return fields
+
+    def record(self, i: int) -> Dict:
+        """第 i 条记录，与 run_single_experiment 的返回格式一致"""
+        c = self.columns
+        identity = self.identities[c["identity"][i]]
+        question = self.questions[c["question"][i]]
+        record = {"identity_key": identity["identity_key"], "identity_name": identity["identity_name"]}
+        record.update(self._identity_fields(identity))
+        record.update({
+            "question_id": question["question_id"],
+            "question": question["question"],
+            "category": question["category"],
+            "difficulty": question["difficulty"],
+            "run_id": c["run_id"][i],
+            "timestamp": c["timestamp"][i],
+            "success": bool(c["success"][i]),
+        })
+        if i in self.errors:
+            record["error"] = self.errors[i]
+        record["response"] = self.response(i)
+        if c["success"][i]:
+            record["model"] = self.models[c["model"][i]]
+            record["usage"] = {
+                "prompt_tokens": c["prompt_tokens"][i],
+                "completion_tokens": c["completion_tokens"][i],
+                "total_tokens": c["total_tokens"][i],
+            }
+            record["latency"] = c["latency"][i]
+        record.update(self.extra.get(i, {}))
+        return record
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def system_prompt(self, i: int) -> Optional[str]:
+        """
+        第 i 条结果生成时使用的 system prompt；
+        只返回记录自带或与记录哈希一致的原文，无法确认时返回 None
+        """
+        return self.identities[self.columns["identity"][i]]["system_prompt"]
+
+    def to_table(self) -> ResultTable:
+        """
+        直接由规范化的表构造 ResultTable，响应文本保持惰性解压
+        """
+        table = ResultTable()
+        c = self.columns
+        identity_ids = [table.identities.intern((r["identity_key"], r["identity_name"])) for r in self.identities]
+        question_ids = [table.questions.intern((r["question_id"], r["question"])) for r in self.questions]
+        category_ids = [table.categories.intern(r["category"]) for r in self.questions]
+        difficulty_ids = [table.difficulties.intern(r["difficulty"]) for r in self.questions]
+        model_ids = [table.models.intern(m) for m in self.models]
+
+        table.identity_ids.extend(identity_ids[k] for k in c["identity"])
+        table.question_ids.extend(question_ids[k] for k in c["question"])
+        table.category_ids.extend(category_ids[k] for k in c["question"])
+        table.difficulty_ids.extend(difficulty_ids[k] for k in c["question"])
+        table.model_ids.extend(model_ids[k] for k in c["model"])
+        table.run_ids.extend(c["run_id"])
+        for ts in c["timestamp"]:
+            micros, offset = encode_timestamp(ts)
+            table.timestamps.append(micros)
+            table.tz_offsets.append(offset)
+        table.success.extend(c["success"])
+        table.prompt_tokens.extend(c["prompt_tokens"])
+        table.completion_tokens.extend(c["completion_tokens"])
+        table.total_tokens.extend(c["total_tokens"])
+        table.latencies.extend(c["latency"])
+        table.response_lengths.extend(c["response_chars"])
+        table.responses = _LazyResponses(self)
+        table.errors = dict(self.errors)
+        for i, identity_id in enumerate(c["identity"]):
+            others = {**self._identity_fields(self.identities[identity_id]), **self.extra.get(i, {})}
+            if others:
+                table.extra[i] = others
+        return table
+
+
+def iter_store(full_path: str) -> Iterator[Dict]:
+    with ResultStore(full_path) as store:
+        yield from store
+
+
+def pack(src_file: str, dst_file: str = None) -> Dict:
+    """把 JSON / JSONL 结果文件归档为 .store"""
+    src_path = os.path.join(os.path.dirname(__file__), src_file)
+    dst_path = os.path.join(os.path.dirname(__file__), dst_file or os.path.splitext(src_file)[0] + ".store")
+    stats = write_store(iter_results(src_path), dst_path)
+    source_size = os.path.getsize(src_path)
+    print(f"📦 已归档 {src_file} → {os.path.relpath(dst_path, os.path.dirname(__file__))}")
+    print(f"  记录 {stats['records']} 条, 问题 {stats['questions']} 个, 身份 {stats['identities']} 个")
+    print(f"  响应文本 {stats['response_bytes']:,} B → {stats['blob_bytes']:,} B "
+          f"(另有共享字典)")
+    print(f"  文件大小 {source_size:,} B → {stats['file_size']:,} B "
+          f"({source_size / max(stats['file_size'], 1):.1f}x)")
+    return stats
+
+
+def unpack(src_file: str, dst_file: str = None) -> int:
+    """把 .store 还原为 JSONL 结果文件"""
+    src_path = os.path.join(os.path.dirname(__file__), src_file)
+    dst_path = os.path.join(os.path.dirname(__file__), dst_file or os.path.splitext(src_file)[0] + ".jsonl")
+    count = 0
+    with open(dst_path, 'w', encoding='utf-8') as f:
+        for record in iter_store(src_path):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"📂 已还原 {count} 条记录到 {os.path.relpath(dst_path, os.path.dirname(__file__))}")
+    return count
+
+
+def print_store_info(file_path: str):
+    full_path = os.path.join(os.path.dirname(__file__), file_path)
+    with ResultStore(full_path) as store:
+        print(f"\n🗄️  {file_path}: {len(store)} 条记录, {os.path.getsize(full_path):,} B")
+        print(f"\n{'身份':<20} {'prompt 哈希':<18} {'来源':<10} 条数")
+        print("-" * 60)
+        usage = Counter(store.columns["identity"])
+        for k, row in enumerate(store.identities):
+            digest = (row["prompt_hash"] or "-")[:16]
+            print(f"{row['identity_name']:<20} {digest:<18} {row['prompt_source']:<10} {usage[k]}")
+        print(f"\n{'问题':<20} {'prompt 哈希':<18} 条数")
+        print("-" * 50)
+        usage = Counter(store.columns["question"])
+        for k, row in enumerate(store.questions):
+            print(f"{row['question_id']:<20} {row['prompt_hash'][:16]:<18} {usage[k]}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="规范化的结果归档")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="JSON / JSONL 结果文件 → .store")
+    p.add_argument("src")
+    p.add_argument("dst", nargs="?")
+    p = sub.add_parser("unpack", help=".store → JSONL 结果文件")
+    p.add_argument("src")
+    p.add_argument("dst", nargs="?")
+    p = sub.add_parser("info", help="查看归档中的身份 / 问题表")
+    p.add_argument("src")
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        pack(args.src, args.dst)
+    elif args.command == "unpack":
+        unpack(args.src, args.dst)
+    else:
+        print_store_info(args.src)
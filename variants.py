@@ -0,0 +1,155 @@
+"""
+身份变体生成器
+按 config.PERSONA_GRAMMAR 的模板文法惰性展开身份变体，
+变体 id 只取决于各因子的取值，与采样方式和展开顺序无关
+"""
+
+import hashlib
+import random
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from config import PERSONA_GRAMMAR, TEST_QUESTIONS
+
+
+class PersonaVariant(NamedTuple):
+    variant_id: str
+    name: str
+    levels: Tuple[Tuple[str, str], ...]   # ((因子, 水平键), ...)
+    system_prompt: str
+
+
+class PersonaGrammar:
+    """
+    模板 x 因子水平 的笛卡尔积，按混合进制下标随机访问，从不物化整个积
+    """
+
+    def __init__(self, template: str, factors: Dict[str, Dict[str, str]]):
+        self.template = template
+        self.factor_names = list(factors.keys())
+        self.level_keys = [list(factors[f].keys()) for f in self.factor_names]
+        self.level_texts = [list(factors[f].values()) for f in self.factor_names]
+
+    @classmethod
+    def from_config(cls, grammar: Dict = None) -> "PersonaGrammar":
+        grammar = grammar or PERSONA_GRAMMAR
+        return cls(grammar["template"], grammar["factors"])
+
+    def __len__(self) -> int:
+        size = 1
+        for keys in self.level_keys:
+            size *= len(keys)
+        return size
+
+    def variant(self, choice: Iterable[int]) -> PersonaVariant:
+        """由每个因子的水平下标构造变体"""
+        choice = list(choice)
+        levels = tuple(
+            (name, keys[c]) for name, keys, c in zip(self.factor_names, self.level_keys, choice)
+        )
+        fills = {name: texts[c] for name, texts, c in zip(self.factor_names, self.level_texts, choice)}
+        digest = hashlib.sha1("|".join(f"{f}={l}" for f, l in levels).encode('utf-8')).hexdigest()
+        return PersonaVariant(
+            variant_id=f"v_{digest[:12]}",
+            name="/".join(level for _, level in levels),
+            levels=levels,
+            system_prompt=self.template.format(**fills)
+        )
+
+    def _choice_at(self, index: int) -> Tuple[int, ...]:
+        choice = []
+        for keys in reversed(self.level_keys):
+            index, c = divmod(index, len(keys))
+            choice.append(c)
+        return tuple(reversed(choice))
+
+    def variant_at(self, index: int) -> PersonaVariant:
+        """第 index 个组合 (最后一个因子变化最快)"""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.variant(self._choice_at(index))
+
+    # ---------- 采样策略 ----------
+
+    def full_factorial(self) -> Iterator[PersonaVariant]:
+        """按顺序惰性产出全部组合"""
+        for index in range(len(self)):
+            yield self.variant_at(index)
+
+    def random_subset(self, n: int, seed: int = 0) -> Iterator[PersonaVariant]:
+        """无放回随机抽取 n 个组合"""
+        rng = random.Random(seed)
+        for index in rng.sample(range(len(self)), min(n, len(self))):
+            yield self.variant_at(index)
+
+    def latin_hypercube(self, n: int, seed: int = 0) -> Iterator[PersonaVariant]:
+        """
+        拉丁超立方采样：每个因子的 [0, 1) 区间等分为 n 层，每层恰好取一次，
+        再映射到该因子的水平，使每个水平出现次数尽量均衡
+
+        产出恰好 min(n, len(self)) 个互不相同的变体：与已产出组合重复的行
+        先尝试只改动一个因子的水平，仍然重复时改用随机抽取的未用组合
+        """
+        n = min(n, len(self))
+        rng = random.Random(seed)
+        columns = []
+        for keys in self.level_keys:
+            strata = list(range(n))
+            rng.shuffle(strata)
+            columns.append([int((s + rng.random()) / n * len(keys)) for s in strata])
+
+        seen = set()
+        for i in range(n):
+            choice = tuple(column[i] for column in columns)
+            if choice in seen:
+                choice = self._unseen_neighbor(choice, seen, rng)
+            seen.add(choice)
+            yield self.variant(choice)
+
+    def _unseen_neighbor(self, choice: Tuple[int, ...], seen: set, rng: random.Random) -> Tuple[int, ...]:
+        factors = list(range(len(choice)))
+        rng.shuffle(factors)
+        for f in factors:
+            levels = list(range(len(self.level_keys[f])))
+            rng.shuffle(levels)
+            for level in levels:
+                candidate = choice[:f] + (level,) + choice[f + 1:]
+                if candidate not in seen:
+                    return candidate
+        while True:
+            candidate = self._choice_at(rng.randrange(len(self)))
+            if candidate not in seen:
+                return candidate
+
+    def sample(self, strategy: str = "factorial", n: int = None, seed: int = 0) -> Iterator[PersonaVariant]:
+        """
+        Args:
+            strategy: factorial (全因子) / lhs (拉丁超立方) / random (随机子集)
+            n: lhs 与 random 的样本数；超过全组合数时按全组合数截断，产出的变体互不重复
+            seed: 随机种子
+        """
+        if strategy == "factorial":
+            return self.full_factorial()
+        if n is None:
+            raise ValueError(f"strategy '{strategy}' 需要指定样本数 n")
+        if strategy == "lhs":
+            return self.latin_hypercube(n, seed)
+        if strategy == "random":
+            return self.random_subset(n, seed)
+        raise ValueError(f"未知采样策略: {strategy}")
+
+
+def iter_tasks(
+    variants: Iterable[PersonaVariant],
+    categories: List[str] = None,
+    num_runs: int = 1
+) -> Iterator[Tuple[PersonaVariant, Dict, int]]:
+    """
+    惰性产出 (变体, 问题, 运行序号) 任务流
+    """
+    if categories is None:
+        categories = list(TEST_QUESTIONS.keys())
+    questions = [q for category in categories for q in TEST_QUESTIONS[category]]
+    for variant in variants:
+        for question_data in questions:
+            for run in range(1, num_runs + 1):
+                yield variant, question_data, run
@@ -3,50 +3,64 @@
 生成图表展示不同身份对响应的影响
 """
 
-import json
 import os
 from collections import defaultdict
 import matplotlib.pyplot as plt
 import matplotlib
 import numpy as np
 
+from records import load_table
+from aggregate_cache import load_artifacts
+from aggregates import IncrementalAggregates
+from features import FEATURE_LABELS
+from sketch import SketchSet, report_sketches
+
 # 设置中文字体
 matplotlib.rcParams['font.sans-serif'] = ['Arial Unicode MS', 'SimHei', 'STHeiti']
 matplotlib.rcParams['axes.unicode_minus'] = False
 
 def load_results(file_path: str = "results.json"):
-    """加载实验结果"""
+    """加载实验结果为紧凑的 ResultTable"""
     full_path = os.path.join(os.path.dirname(__file__), file_path)
-    with open(full_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return load_table(full_path)
+
+def _aggregate(results, aggregates: IncrementalAggregates = None) -> IncrementalAggregates:
+    """未传入预先计算 (或缓存) 的聚合时，从结果记录计算"""
+    return aggregates if aggregates is not None else IncrementalAggregates().update(results)
 
-def plot_response_length_by_identity(results, save_path: str = "viz_length_by_identity.png"):
+def _metric_label(metric: str) -> str:
+    return "响应长度 (字符)" if metric == "length" else FEATURE_LABELS[metric]
+
+def plot_response_length_by_identity(results, save_path: str = "viz_length_by_identity.png",
+                                     aggregates: IncrementalAggregates = None, metric: str = "length"):
     """
     图1: 不同身份的平均响应长度
+    metric 可换成 features.FEATURES 中的任一特征
     """
     # 按身份聚合
-    by_identity = defaultdict(list)
-    for r in results:
-        if r.get("success") and r.get("response"):
-            by_identity[r["identity_name"]].append(len(r["response"]))
+    by_identity = {
+        i: s.column(metric) for i, s in _aggregate(results, aggregates).by_identity.items()
+        if s.column(metric).count
+    }
     
     identities = list(by_identity.keys())
-    avg_lengths = [np.mean(by_identity[i]) for i in identities]
-    std_lengths = [np.std(by_identity[i]) for i in identities]
+    avg_lengths = [by_identity[i].mean for i in identities]
+    std_lengths = [by_identity[i].std for i in identities]
     
     fig, ax = plt.subplots(figsize=(12, 6))
     bars = ax.bar(identities, avg_lengths, yerr=std_lengths, capsize=5, 
                   color=plt.cm.Set3(np.linspace(0, 1, len(identities))))
     
     ax.set_xlabel('身份', fontsize=12)
-    ax.set_ylabel('平均响应长度 (字符)', fontsize=12)
-    ax.set_title('不同身份的平均响应长度对比', fontsize=14, fontweight='bold')
+    ax.set_ylabel(f'平均{_metric_label(metric)}', fontsize=12)
+    ax.set_title(f'不同身份的平均{FEATURE_LABELS[metric]}对比', fontsize=14, fontweight='bold')
     ax.tick_params(axis='x', rotation=45)
     
     # 添加数值标签
+    offset = max(avg_lengths, default=0) * 0.01
     for bar, val in zip(bars, avg_lengths):
-        ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 50, 
-                f'{val:.0f}', ha='center', va='bottom', fontsize=10)
+        ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + offset, 
+                f'{val:.0f}' if val >= 10 else f'{val:.2f}', ha='center', va='bottom', fontsize=10)
     
     plt.tight_layout()
     full_path = os.path.join(os.path.dirname(__file__), save_path)
@@ -54,18 +68,15 @@ def plot_response_length_by_identity(results, save_path: str = "viz_length_by_id
     plt.close()
     print(f"✅ 已保存: {save_path}")
 
-def plot_token_usage_by_identity(results, save_path: str = "viz_tokens_by_identity.png"):
+def plot_token_usage_by_identity(results, save_path: str = "viz_tokens_by_identity.png",
+                                 aggregates: IncrementalAggregates = None):
     """
     图2: 不同身份的Token使用量
     """
-    by_identity = defaultdict(list)
-    for r in results:
-        if r.get("success"):
-            tokens = r.get("usage", {}).get("total_tokens", 0)
-            by_identity[r["identity_name"]].append(tokens)
+    by_identity = {i: s.tokens for i, s in _aggregate(results, aggregates).by_identity.items() if s.tokens.count}
     
     identities = list(by_identity.keys())
-    avg_tokens = [np.mean(by_identity[i]) for i in identities]
+    avg_tokens = [by_identity[i].mean for i in identities]
     
     fig, ax = plt.subplots(figsize=(12, 6))
     colors = plt.cm.Pastel1(np.linspace(0, 1, len(identities)))
@@ -86,24 +97,26 @@ def plot_token_usage_by_identity(results, save_path: str = "viz_tokens_by_identi
     plt.close()
     print(f"✅ 已保存: {save_path}")
 
-def plot_heatmap_identity_category(results, save_path: str = "viz_heatmap.png"):
+def plot_heatmap_identity_category(results, save_path: str = "viz_heatmap.png",
+                                   aggregates: IncrementalAggregates = None, metric: str = "length"):
     """
-    图3: 身份x类别 热力图 (响应长度)
+    图3: 身份x类别 热力图 (默认为响应长度，可换成任一特征)
     """
     # 构建矩阵
-    data = defaultdict(lambda: defaultdict(list))
-    for r in results:
-        if r.get("success") and r.get("response"):
-            data[r["identity_name"]][r["category"]].append(len(r["response"]))
+    data = {
+        key: s.column(metric)
+        for key, s in _aggregate(results, aggregates).by_identity_category.items()
+        if s.column(metric).count
+    }
     
-    identities = sorted(set(r["identity_name"] for r in results if r.get("success")))
-    categories = sorted(set(r["category"] for r in results if r.get("success")))
+    identities = sorted(set(identity for identity, _ in data))
+    categories = sorted(set(category for _, category in data))
     
     matrix = np.zeros((len(identities), len(categories)))
     for i, identity in enumerate(identities):
         for j, category in enumerate(categories):
-            if data[identity][category]:
-                matrix[i, j] = np.mean(data[identity][category])
+            if (identity, category) in data:
+                matrix[i, j] = data[(identity, category)].mean
     
     fig, ax = plt.subplots(figsize=(12, 8))
     im = ax.imshow(matrix, cmap='YlOrRd', aspect='auto')
@@ -118,11 +131,11 @@ def plot_heatmap_identity_category(results, save_path: str = "viz_heatmap.png"):
     # 添加数值
     for i in range(len(identities)):
         for j in range(len(categories)):
-            text = ax.text(j, i, f'{matrix[i, j]:.0f}',
+            text = ax.text(j, i, f'{matrix[i, j]:.0f}' if matrix[i, j] >= 10 else f'{matrix[i, j]:.2f}',
                           ha="center", va="center", color="black", fontsize=9)
     
-    ax.set_title('身份 × 问题类别 响应长度热力图', fontsize=14, fontweight='bold')
-    fig.colorbar(im, ax=ax, label='平均响应长度')
+    ax.set_title(f'身份 × 问题类别 {FEATURE_LABELS[metric]}热力图', fontsize=14, fontweight='bold')
+    fig.colorbar(im, ax=ax, label=f'平均{FEATURE_LABELS[metric]}')
     
     plt.tight_layout()
     full_path = os.path.join(os.path.dirname(__file__), save_path)
@@ -130,21 +143,29 @@ def plot_heatmap_identity_category(results, save_path: str = "viz_heatmap.png"):
     plt.close()
     print(f"✅ 已保存: {save_path}")
 
-def plot_latency_comparison(results, save_path: str = "viz_latency.png"):
+def plot_latency_comparison(results, save_path: str = "viz_latency.png", sketches: SketchSet = None):
     """
     图4: 响应延迟对比
+    箱线图的分位数取自可合并的分位数草图，绘制成本与样本量无关：
+    箱体为 p25-p75，中线为 p50，须线为 p1-p99
     """
-    by_identity = defaultdict(list)
-    for r in results:
-        if r.get("success"):
-            by_identity[r["identity_name"]].append(r.get("latency", 0))
+    if sketches is None:
+        sketches = SketchSet().update(results)
+    by_identity = sketches.groups("latency", "identity")
     
     fig, ax = plt.subplots(figsize=(12, 6))
     
-    data = [by_identity[identity] for identity in by_identity.keys()]
     labels = list(by_identity.keys())
+    stats = []
+    for identity, sketch in by_identity.items():
+        p1, p25, p50, p75, p99 = sketch.quantiles((0.01, 0.25, 0.5, 0.75, 0.99))
+        stats.append({
+            "label": identity,
+            "whislo": p1, "q1": p25, "med": p50, "q3": p75, "whishi": p99,
+            "mean": sketch.mean, "fliers": []
+        })
     
-    bp = ax.boxplot(data, labels=labels, patch_artist=True)
+    bp = ax.bxp(stats, patch_artist=True, showmeans=True)
     
     colors = plt.cm.Set2(np.linspace(0, 1, len(labels)))
     for patch, color in zip(bp['boxes'], colors):
@@ -152,7 +173,7 @@ def plot_latency_comparison(results, save_path: str = "viz_latency.png"):
     
     ax.set_xlabel('身份', fontsize=12)
     ax.set_ylabel('响应延迟 (秒)', fontsize=12)
-    ax.set_title('不同身份的响应延迟分布', fontsize=14, fontweight='bold')
+    ax.set_title('不同身份的响应延迟分布 (p1 / p25 / p50 / p75 / p99)', fontsize=14, fontweight='bold')
     ax.tick_params(axis='x', rotation=45)
     
     plt.tight_layout()
@@ -161,25 +182,20 @@ def plot_latency_comparison(results, save_path: str = "viz_latency.png"):
     plt.close()
     print(f"✅ 已保存: {save_path}")
 
-def plot_category_comparison(results, save_path: str = "viz_category_comparison.png"):
+def plot_category_comparison(results, save_path: str = "viz_category_comparison.png",
+                             aggregates: IncrementalAggregates = None, metric: str = "length"):
     """
     图5: 不同问题类别下身份效应对比
     """
-    data = defaultdict(lambda: defaultdict(list))
-    for r in results:
-        if r.get("success") and r.get("response"):
-            data[r["category"]][r["identity_name"]].append(len(r["response"]))
+    data = defaultdict(dict)
+    for (identity, category), s in _aggregate(results, aggregates).by_identity_category.items():
+        if s.column(metric).count:
+            data[category][identity] = s.column(metric).mean
     
     categories = list(data.keys())
     if not categories:
         print("⚠️ 无数据可视化")
         return
-        
-    identities = list(set(
-        identity 
-        for category_data in data.values() 
-        for identity in category_data.keys()
-    ))
     
     fig, axes = plt.subplots(2, 3, figsize=(15, 10))
     axes = axes.flatten()
@@ -188,20 +204,20 @@ def plot_category_comparison(results, save_path: str = "viz_category_comparison.
         ax = axes[idx]
         
         cat_identities = list(data[category].keys())
-        avg_lengths = [np.mean(data[category][i]) if data[category][i] else 0 for i in cat_identities]
+        avg_lengths = [data[category][i] for i in cat_identities]
         
         bars = ax.bar(range(len(cat_identities)), avg_lengths, 
                      color=plt.cm.tab10(np.linspace(0, 1, len(cat_identities))))
         ax.set_xticks(range(len(cat_identities)))
         ax.set_xticklabels(cat_identities, rotation=45, ha='right', fontsize=8)
         ax.set_title(f'{category}', fontsize=11, fontweight='bold')
-        ax.set_ylabel('响应长度')
+        ax.set_ylabel(FEATURE_LABELS[metric])
     
     # 隐藏多余的子图
     for idx in range(len(categories), len(axes)):
         axes[idx].axis('off')
     
-    fig.suptitle('不同问题类别下各身份的响应长度对比', fontsize=14, fontweight='bold')
+    fig.suptitle(f'不同问题类别下各身份的{FEATURE_LABELS[metric]}对比', fontsize=14, fontweight='bold')
     plt.tight_layout()
     
     full_path = os.path.join(os.path.dirname(__file__), save_path)
@@ -209,46 +225,75 @@ def plot_category_comparison(results, save_path: str = "viz_category_comparison.
     plt.close()
     print(f"✅ 已保存: {save_path}")
 
-def generate_all_visualizations(results_file: str = "results.json"):
+def plot_feature_charts(aggregates: IncrementalAggregates, metric: str):
     """
-    生成所有可视化图表
+    以某个响应特征代替响应长度绘制图1/3/5，文件名带特征后缀
     """
-    print("\n📊 生成可视化图表...")
-    print("=" * 50)
-    
-    results = load_results(results_file)
-    successful_results = [r for r in results if r.get("success")]
-    
-    if not successful_results:
-        print("❌ 没有成功的实验结果可供可视化")
-        return
-    
-    print(f"加载了 {len(successful_results)} 条成功结果")
+    if metric not in FEATURE_LABELS:
+        raise ValueError(f"未知特征: {metric}，可选: {', '.join(FEATURE_LABELS)}")
+    if not aggregates.has_column(metric):
+        raise ValueError(f"特征 {metric} 没有数据: 聚合未经 features.featurize 计算")
+    plot_response_length_by_identity(None, f"viz_{metric}_by_identity.png", aggregates, metric)
+    plot_heatmap_identity_category(None, f"viz_heatmap_{metric}.png", aggregates, metric)
+    plot_category_comparison(None, f"viz_category_comparison_{metric}.png", aggregates, metric)
+
+def plot_all(successful_results, sketches: SketchSet = None, aggregates: IncrementalAggregates = None):
+    """
+    依次生成全部图表，单个图表失败不影响其余图表
+    传入 aggregates 与 sketches 时完全基于聚合绘图，successful_results 可为 None
+    """
+    if aggregates is None:
+        aggregates = IncrementalAggregates().update(successful_results)
     
     try:
-        plot_response_length_by_identity(successful_results)
+        plot_response_length_by_identity(successful_results, aggregates=aggregates)
     except Exception as e:
         print(f"⚠️ 图1生成失败: {e}")
     
     try:
-        plot_token_usage_by_identity(successful_results)
+        plot_token_usage_by_identity(successful_results, aggregates=aggregates)
     except Exception as e:
         print(f"⚠️ 图2生成失败: {e}")
     
     try:
-        plot_heatmap_identity_category(successful_results)
+        plot_heatmap_identity_category(successful_results, aggregates=aggregates)
     except Exception as e:
         print(f"⚠️ 图3生成失败: {e}")
     
     try:
-        plot_latency_comparison(successful_results)
+        plot_latency_comparison(successful_results, sketches=sketches)
     except Exception as e:
         print(f"⚠️ 图4生成失败: {e}")
     
     try:
-        plot_category_comparison(successful_results)
+        plot_category_comparison(successful_results, aggregates=aggregates)
     except Exception as e:
         print(f"⚠️ 图5生成失败: {e}")
+
+def generate_all_visualizations(results_file: str = "results.json", metrics: list = None, sketch_files: list = None):
+    """
+    生成所有可视化图表
+    聚合取自与 analysis.py 共用的派生结果缓存，无需重新解析结果文件；
+    延迟分布优先取自 sketch_files 或结果文件旁的草图文件 (见 sketch.report_sketches)
+    """
+    print("\n📊 生成可视化图表...")
+    print("=" * 50)
+    
+    artifacts, _ = load_artifacts(results_file)
+    
+    if not artifacts.aggregates.successful:
+        print("❌ 没有成功的实验结果可供可视化")
+        return
+    
+    print(f"加载了 {artifacts.aggregates.successful} 条成功结果")
+    
+    plot_all(None, report_sketches(results_file, artifacts.sketches, sketch_files), artifacts.aggregates)
+    
+    for metric in metrics or []:
+        try:
+            plot_feature_charts(artifacts.aggregates, metric)
+        except Exception as e:
+            print(f"⚠️ 特征 {metric} 图表生成失败: {e}")
     
     print("\n" + "=" * 50)
     print("✅ 可视化完成！")
@@ -256,13 +301,21 @@ def generate_all_visualizations(results_file: str = "results.json"):
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) > 1:
-        results_file = sys.argv[1]
+    # --sketches 之后的参数为用于延迟分布图的草图文件
+    args = sys.argv[1:]
+    sketch_files = None
+    if "--sketches" in args:
+        i = args.index("--sketches")
+        args, sketch_files = args[:i], args[i + 1:]
+    
+    if args:
+        results_file = args[0]
     else:
         if os.path.exists(os.path.join(os.path.dirname(__file__), "demo_results.json")):
             results_file = "demo_results.json"
         else:
             results_file = "results.json"
     
-    generate_all_visualizations(results_file)
+    # 其余参数为额外绘制的响应特征，例如: python visualize.py results.json hedges disclaimer
+    generate_all_visualizations(results_file, args[1:], sketch_files)
 